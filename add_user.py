@@ -3,7 +3,7 @@ from data.__all_models import User
 from config import *
 
 if __name__ == "__main__":
-    global_init(db_password, db_username, db_address, db_name)
+    global_init(db_password, db_username, db_address, db_name, url=db_url)
     sess = create_session()
 
     name = input("Введите имя: ")
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import os
+import uuid
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    """
+    Кэш скомпилированных решений на диске.
+    Ключ - хэш исходного кода, компилятора и его опций.
+    Давно не использованные файлы удаляются (LRU по времени изменения файла)
+    """
+
+    def __init__(self, directory: str, max_entries: int):
+        """
+        :param directory: папка для хранения скомпилированных файлов
+        :param max_entries: максимальное количество файлов в кэше
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._key_locks = {}
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def make_key(compiler: str, options: str, extension: str, source: bytes) -> str:
+        digest = hashlib.sha256()
+        for part in (compiler, options or "", extension or ""):
+            digest.update(part.encode("utf8"))
+            digest.update(b"\0")
+        digest.update(source)
+        return digest.hexdigest()
+
+    def get_or_build(self, key: str, build) -> str:
+        """
+        :param key: ключ из make_key
+        :param build: функция build(output_path), которая компилирует решение в output_path.
+            Может бросить исключение - тогда в кэш ничего не попадёт
+        :return: путь до скомпилированного файла
+        """
+        path = os.path.join(self.directory, key)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, Lock())
+
+        # Одинаковые решения, пришедшие одновременно, компилируются один раз
+        with key_lock:
+            if os.path.exists(path):
+                with self._lock:
+                    self.hits += 1
+                os.utime(path)
+                return path
+
+            with self._lock:
+                self.misses += 1
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                build(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        with self._lock:
+            self._key_locks.pop(key, None)
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep: str = None):
+        """Удаляет самые старые файлы, пока их не станет не больше max_entries"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".tmp") or name == keep:
+                    continue
+                try:
+                    entries.append((os.stat(os.path.join(self.directory, name)).st_mtime, name))
+                except FileNotFoundError:
+                    continue
+
+            extra = len(entries) + (keep is not None) - self.max_entries
+            for _, name in sorted(entries)[:max(extra, 0)]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def to_json(self) -> dict:
+        return {
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,390 @@
+"""
+Нагрузочный тест HTTP API.
+
+Скрипт заполняет базу курсами, уроками, заданиями, пользователями и решениями,
+поднимает сервер (или использует уже запущенный, --url) и по очереди нагружает
+основные обработчики с разным количеством одновременных клиентов.
+Для каждого обработчика и уровня параллельности считаются пропускная способность,
+задержки p50/p95/p99 и количество SQL-запросов на запрос (заголовок X-Query-Count).
+Результаты пишутся в JSON, чтобы сравнивать их между коммитами.
+
+Данные не удаляются, поэтому запускать нужно на одноразовой базе: файле SQLite
+    python -m benchmarks.http_bench --db-url sqlite:///bench.sqlite --output bench.json
+или PostgreSQL, например
+    docker run --rm -d -p 5433:5432 -e POSTGRES_PASSWORD=bench -e POSTGRES_DB=bench postgres
+    DB_ADDRESS=localhost:5433 DB_USERNAME=postgres DB_PASSWORD=bench DB_NAME=bench \\
+        python -m benchmarks.http_bench --output bench.json
+
+Запуск из корня репозитория: python -m benchmarks.http_bench --help
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+from werkzeug.serving import make_server
+
+from benchmarks.report import latency_ms, make_report, save
+from data.database import global_init, create_session
+from data.__all_models import (Role, User, Language, Course, Lesson, Link,
+                               Task, Solve, TestResult, Attendance)
+
+PASSWORD = "bench-password"
+ENDPOINTS = ("login", "courses", "course", "lesson", "task", "solve", "submit")
+
+
+def seed(sess: Session, courses: int, lessons: int, tasks: int, users: int, solves: int) -> dict:
+    """
+    Заполняет базу и возвращает ID записей, к которым обращается тест.
+    Все пользователи записаны на все курсы и имеют роль без полномочий (ученики)
+    :param courses: количество курсов
+    :param lessons: уроков в курсе
+    :param tasks: заданий в уроке
+    :param users: количество пользователей
+    :param solves: решений у каждого пользователя
+    """
+    tag = uuid.uuid4().hex[:8]  # чтобы повторный запуск не конфликтовал по логинам
+    rows = {name: [] for name in ("roles", "users", "languages", "courses", "lessons",
+                                  "links", "tasks", "solves", "test_results", "attendance")}
+
+    def add(table, **values):
+        values.setdefault("id", uuid.uuid4())
+        rows[table].append(values)
+        return values["id"]
+
+    # Хэш пароля считается долго, поэтому он один на всех пользователей
+    probe = User("", "", "", None)
+    probe.generate_hash_password(PASSWORD)
+
+    role_id = add("roles", title=f"bench-{tag}", permissions="")
+    language_id = add("languages", name=f"Python bench-{tag}", path=sys.executable, options="",
+                      runner="process", extension="py")
+    logins = [f"bench_{tag}_{i}" for i in range(users)]
+    user_ids = [add("users", name=f"user {i}", login=login, email=f"{login}@example.com",
+                    password=probe.password, role_id=role_id)
+                for i, login in enumerate(logins)]
+
+    tests = {"tests": [{"input": str(i), "output": str(i)} for i in range(3)]}
+    course_ids, lesson_ids, task_ids = [], [], []
+    for i in range(courses):
+        course_id = add("courses", name=f"bench course {i}", description="course " * 20,
+                        language_id=language_id, is_public=True, author_id=user_ids[0])
+        course_ids.append(course_id)
+        for j in range(lessons):
+            lesson_id = add("lessons", course_id=course_id, name=f"lesson {j}",
+                            description="lesson " * 20, order=j)
+            lesson_ids.append(lesson_id)
+            add("links", lesson_id=lesson_id, title="docs", link="https://docs.python.org")
+            for k in range(tasks):
+                task_ids.append(add("tasks", lesson_id=lesson_id, name=f"task {k}",
+                                    task_condition="condition " * 20, tests=tests,
+                                    time_limit=1, order=k))
+
+    solve_ids = {}
+    for n, user_id in enumerate(user_ids):
+        for course_id in course_ids:
+            add("attendance", user_id=user_id, course_id=course_id)
+        solve_ids[logins[n]] = []
+        for m in range(solves):
+            solve_id = add("solves", task_id=task_ids[(n * solves + m) % len(task_ids)],
+                           user_id=user_id, verdict="OK" if m % 3 else "Wrong answer",
+                           code="print(input())", time=1, memory=1024)
+            solve_ids[logins[n]].append(solve_id)
+            for number in range(1, 4):
+                add("test_results", solve_id=solve_id, number=number, status="OK",
+                    cpu_time=1, wall_time=2, memory=1024)
+
+    for name, model in (("roles", Role), ("users", User), ("languages", Language),
+                        ("courses", Course), ("lessons", Lesson), ("links", Link),
+                        ("tasks", Task), ("solves", Solve), ("test_results", TestResult),
+                        ("attendance", Attendance)):
+        if rows[name]:
+            sess.execute(sa.insert(model), rows[name])
+    sess.commit()
+
+    return {"logins": logins, "course_ids": [str(i) for i in course_ids],
+            "lesson_ids": [str(i) for i in lesson_ids], "task_ids": [str(i) for i in task_ids],
+            "solve_ids": {login: [str(i) for i in ids] for login, ids in solve_ids.items()}}
+
+
+class Client:
+    """HTTP-клиент с отдельным соединением в каждом потоке"""
+
+    def __init__(self, url: str, timeout: float = 60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def request(self, method: str, path: str, token: str = None, body: dict = None):
+        """
+        :return: (код ответа, JSON ответа или None, задержка в секундах, SQL-запросов или None)
+        """
+        headers = {}
+        data = None
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if body is not None:
+            data = json.dumps(body).encode("utf8")
+            headers["Content-Type"] = "application/json"
+
+        connection = self._connection()
+        start = perf_counter()
+        try:
+            connection.request(method, self.prefix + path, data, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+        latency = perf_counter() - start
+
+        queries = response.getheader("X-Query-Count")
+        try:
+            payload = json.loads(content) if content else None
+        except ValueError:
+            payload = None
+        return response.status, payload, latency, int(queries) if queries is not None else None
+
+
+def make_requests(ids: dict, tokens: dict) -> dict:
+    """
+    Имя обработчика -> функция, которая по номеру запроса возвращает (метод, путь, токен, тело)
+    """
+    logins = ids["logins"]
+
+    def user(n):
+        login = logins[n % len(logins)]
+        return login, tokens[login]
+
+    def pick(values, n):
+        return values[(n * 7919) % len(values)]
+
+    def login(n):
+        name, _ = user(n)
+        return "POST", "/login", None, {"login": name, "password": PASSWORD}
+
+    def courses(n):
+        return "GET", "/courses", user(n)[1], None
+
+    def course(n):
+        return "GET", f"/courses/{pick(ids['course_ids'], n)}", user(n)[1], None
+
+    def lesson(n):
+        return "GET", f"/lessons/{pick(ids['lesson_ids'], n)}", user(n)[1], None
+
+    def task(n):
+        return "GET", f"/tasks/{pick(ids['task_ids'], n)}", user(n)[1], None
+
+    def solve(n):
+        name, token = user(n)
+        return "GET", f"/solves/{pick(ids['solve_ids'][name], n)}", token, None
+
+    def submit(n):
+        # Разный код, чтобы решения не брались из кэша вердиктов
+        return ("POST", f"/tasks/{pick(ids['task_ids'], n)}", user(n)[1],
+                {"code": f"print(input())  # {uuid.uuid4().hex}"})
+
+    return {"login": login, "courses": courses, "course": course, "lesson": lesson,
+            "task": task, "solve": solve, "submit": submit}
+
+
+def check_pages(client: Client, token: str, ids: dict):
+    """Листает каталог курсов по курсору до конца, чтобы курсоры ломались до замеров, а не в них"""
+    path, cursor, seen = "/courses?limit=7", None, []
+    while True:
+        status, payload, _, _ = client.request("GET", path + (f"&cursor={cursor}" if cursor else ""), token)
+        if status != 200:
+            raise RuntimeError(f"Can't read page of /courses after {len(seen)} courses: {status} {payload}")
+        seen.extend(course["id"] for course in payload["courses"])
+        cursor = payload["next_cursor"]
+        if cursor is None:
+            break
+    if len(seen) != len(set(seen)) or not set(ids["course_ids"]) <= set(seen):
+        raise RuntimeError("Pages of /courses skip or repeat courses")
+
+
+def run_phase(client: Client, make_request, requests: int, concurrency: int) -> dict:
+    """Выполняет requests запросов в concurrency потоков"""
+    latencies = []
+    queries = []
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            method, path, token, body = make_request(n)
+            try:
+                status, _, latency, count = client.request(method, path, token, body)
+            except (http.client.HTTPException, OSError) as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+                continue
+            with lock:
+                latencies.append(latency)
+                statuses[status] += 1
+                if count is not None:
+                    queries.append(count)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "latency_ms": latency_ms(latencies),
+        "queries": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "max": max(queries) if queries else None
+        },
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "errors": dict(errors)
+    }
+
+
+def start_server(host: str = "127.0.0.1") -> tuple:
+    """
+    Запускает приложение в этом процессе, как в main.py
+    :return: (сервер, адрес)
+    """
+    import main
+
+    main.create_app()
+    main.start_background()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server(host, 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def wait_for_judge(timeout: float = 120):
+    """Ждёт, пока проверятся отправленные решения, чтобы они не мешали следующим замерам"""
+    import main
+
+    deadline = perf_counter() + timeout
+    while main.judge_pool.depth() and perf_counter() < deadline:
+        sleep(0.1)
+
+
+def run(args) -> dict:
+    # config читает DB_URL при импорте и без него требует DB_PASSWORD и другие,
+    # поэтому main и config импортируются только после --db-url
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    import config
+    import main
+
+    global_init(config.db_password, config.db_username, config.db_address, config.db_name,
+                pool_size=config.db_pool_size,
+                max_overflow=config.db_max_overflow,
+                pool_timeout=config.db_pool_timeout,
+                pool_recycle=config.db_pool_recycle,
+                pool_pre_ping=config.db_pool_pre_ping,
+                url=args.db_url or config.db_url)
+
+    sess = create_session()
+    try:
+        started = perf_counter()
+        ids = seed(sess, args.courses, args.lessons, args.tasks, args.users, args.solves)
+        print(f"Seeded in {perf_counter() - started:.1f}s")
+    finally:
+        sess.close()
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server()
+    client = Client(url)
+
+    try:
+        tokens = {}
+        for login in ids["logins"]:
+            status, payload, _, _ = client.request("POST", "/login", body={"login": login, "password": PASSWORD})
+            if status != 200:
+                raise RuntimeError(f"Can't log in as {login}: {status} {payload}")
+            tokens[login] = payload["jwt_access"]
+        check_pages(client, tokens[ids["logins"][0]], ids)
+
+        requests = make_requests(ids, tokens)
+        endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+        levels = [int(level) for level in args.concurrency.split(",")]
+
+        results = []
+        for name in endpoints:
+            for level in levels:
+                if args.warmup:
+                    run_phase(client, requests[name], args.warmup, level)
+                result = {"endpoint": name, **run_phase(client, requests[name], args.requests, level)}
+                results.append(result)
+                latency = result["latency_ms"]
+                print(f"{name:8} c={level:<3} {result['throughput']:9.1f} req/s  "
+                      f"p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms  "
+                      f"p99 {latency['p99']:8.2f} ms  queries {result['queries']['mean']}  "
+                      f"{result['statuses']}")
+                if name == "submit" and server is not None:
+                    wait_for_judge()
+    finally:
+        if server is not None:
+            server.shutdown()
+            main.shutdown(timeout=10)
+
+    params = {"courses": args.courses, "lessons": args.lessons, "tasks": args.tasks,
+              "users": args.users, "solves": args.solves, "requests": args.requests,
+              "warmup": args.warmup, "concurrency": levels}
+    return make_report(params, results, server="in-process" if server is not None else url)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API load test")
+    parser.add_argument("--courses", type=int, default=20, help="number of courses")
+    parser.add_argument("--lessons", type=int, default=10, help="lessons per course")
+    parser.add_argument("--tasks", type=int, default=5, help="tasks per lesson")
+    parser.add_argument("--users", type=int, default=50, help="number of users")
+    parser.add_argument("--solves", type=int, default=20, help="solves per user")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each phase")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated concurrency levels")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help=f"comma separated subset of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--db-url", help="database URL instead of the DB_* settings, e.g. sqlite:///bench.sqlite")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--output", help="file for JSON results (stdout if omitted)")
+    args = parser.parse_args(argv)
+    unknown = set(args.endpoints.split(",")) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    save(run(args), args.output)
@@ -0,0 +1,217 @@
+"""
+Нагрузочный тест проверки решений.
+
+Скрипт проверяет синтетические решения через TaskChecker так же, как потоки JudgePool:
+пачка решений отправляется сразу, их проверяют concurrency потоков. Вердикты не пишутся
+в базу, а отдаются Recorder вместо VerdictWriter, поэтому база и сеть не нужны.
+
+Для каждого случая (echo, cpu, output, tle, re), способа запуска и уровня параллельности
+считаются решения в секунду, задержки от отправки до вердикта и время тестов.
+Отдельно измеряются стоимость запуска процесса на один тест (пустая программа)
+и стоимость сравнения вывода с ответом для каждого режима сравнения.
+
+Запуск из корня репозитория: python -m benchmarks.judge_bench --help
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from benchmarks.report import latency_ms, make_report, save
+from comparators import make_comparator, COMPARE_MODES
+from forkserver import is_supported as forkserver_supported
+from task_checking import TaskChecker, RUNNER_PROCESS, RUNNER_FORKSERVER
+
+CPU_LOOPS = 2_000_000  # итераций цикла в случае cpu
+OUTPUT_LINES = 100_000  # строк вывода в случае output
+
+
+def make_cases(tests: int) -> dict:
+    """
+    Имя случая -> (код решения, тесты задания)
+    :param tests: количество тестов в задании
+    """
+    numbers = [{"input": str(i), "output": str(i)} for i in range(tests)]
+    lines = "\n".join(str(i) for i in range(OUTPUT_LINES))
+    return {
+        "echo": ("print(input())", {"tests": numbers}),
+        "cpu": (f"s = 0\nfor i in range({CPU_LOOPS}):\n    s += i\nprint(input())", {"tests": numbers}),
+        "output": (f"input()\nprint('\\n'.join(str(i) for i in range({OUTPUT_LINES})))",
+                   {"tests": [{"input": str(i), "output": lines} for i in range(tests)]}),
+        # Проверка останавливается на первом непройденном тесте
+        "tle": ("while True:\n    pass", {"tests": numbers}),
+        "re": ("raise ValueError(input())", {"tests": numbers}),
+    }
+
+
+class Recorder:
+    """Заменяет VerdictWriter: запоминает, когда пришёл вердикт, вместо записи в базу"""
+
+    def __init__(self):
+        self.results = {}  # ID решения -> (время вердикта, VerdictResult)
+        self._lock = threading.Lock()
+
+    def submit(self, result):
+        with self._lock:
+            self.results[result.solve_id] = (perf_counter(), result)
+
+
+def make_checker(code: str, tests: dict, runner: str, args, writer) -> TaskChecker:
+    return TaskChecker(code, args.time_limit, sys.executable, tests, "", uuid.uuid4(),
+                       test_workers=args.test_workers,
+                       runner=runner,
+                       writer=writer)
+
+
+def run_level(case: tuple, runner: str, concurrency: int, args) -> dict:
+    """Проверяет args.submissions решений в concurrency потоков"""
+    code, tests = case
+    recorder = Recorder()
+    # Файлы решений создаются до замера, как в обработчике POST /tasks/<id>
+    checkers = [make_checker(code, tests, runner, args, recorder) for _ in range(args.submissions)]
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(checker, None) for checker in checkers]
+        for future in futures:
+            future.result()
+    elapsed = perf_counter() - start
+
+    verdicts = Counter()
+    statuses = Counter()
+    wall, cpu = [], []
+    for _, result in recorder.results.values():
+        verdicts[result.verdict.split("\n")[0][:60]] += 1
+        for test in result.tests:
+            statuses[test.status] += 1
+            wall.append(test.wall_time / 1000)
+            cpu.append(test.cpu_time / 1000)
+
+    return {
+        "submissions": args.submissions,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "submissions_per_second": round(len(recorder.results) / elapsed, 2) if elapsed else 0,
+        "tests_per_second": round(len(wall) / elapsed, 2) if elapsed else 0,
+        "latency_ms": latency_ms([done - start for done, _ in recorder.results.values()]),
+        "test_wall_ms": latency_ms(wall),
+        "test_cpu_ms": latency_ms(cpu),
+        "verdicts": dict(verdicts),
+        "test_statuses": dict(statuses)
+    }
+
+
+def spawn_overhead(runner: str, samples: int, args) -> dict:
+    """Время одного теста пустой программы: запуск процесса, пайпы и завершение"""
+    checker = make_checker("", {"tests": []}, runner, args, None)
+    try:
+        checker.run_test(1, {"input": "", "output": ""})  # прогрев (запуск зиготы forkserver)
+        timings = []
+        for i in range(samples):
+            start = perf_counter()
+            checker.run_test(i + 1, {"input": "", "output": ""})
+            timings.append(perf_counter() - start)
+    finally:
+        checker.cleanup()
+    return latency_ms(timings)
+
+
+def compare_cost(output: str, repeats: int, chunk_size: int = 64 * 1024) -> dict:
+    """
+    Время сравнения правильного вывода с ответом в каждом режиме
+    (вывод подаётся кусками, как при чтении из пайпа)
+    """
+    data = output.encode("utf8")
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [b""]
+    result = {}
+    for mode in COMPARE_MODES:
+        timings = []
+        for _ in range(repeats):
+            start = perf_counter()
+            comparator = make_comparator(output, mode)
+            for chunk in chunks:
+                comparator.feed(chunk)
+            comparator.finish()
+            timings.append(perf_counter() - start)
+        result[mode] = latency_ms(timings)
+    return result
+
+
+def run(args) -> dict:
+    cases = make_cases(args.tests)
+    names = [name.strip() for name in args.cases.split(",") if name.strip()]
+    runners = [runner.strip() for runner in args.runners.split(",") if runner.strip()]
+    if RUNNER_FORKSERVER in runners and not forkserver_supported():
+        print("forkserver is not supported on this platform, skipping it")
+        runners.remove(RUNNER_FORKSERVER)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    # TaskChecker пишет решения в tests/ относительно текущей папки
+    with tempfile.TemporaryDirectory(prefix="judge-bench-") as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            spawn = {runner: spawn_overhead(runner, args.spawn_samples, args) for runner in runners}
+            for runner, latency in spawn.items():
+                print(f"spawn    {runner:10} p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms")
+
+            compare = {}
+            for name in names:
+                output = cases[name][1]["tests"][0]["output"]
+                compare[name] = {"bytes": len(output.encode("utf8")),
+                                 **compare_cost(output, args.compare_repeats)}
+
+            results = []
+            for name in names:
+                for runner in runners:
+                    for level in levels:
+                        result = {"case": name, "runner": runner,
+                                  **run_level(cases[name], runner, level, args)}
+                        results.append(result)
+                        latency = result["latency_ms"]
+                        print(f"{name:8} {runner:10} c={level:<3} "
+                              f"{result['submissions_per_second']:8.2f} subs/s  "
+                              f"p50 {latency['p50']:9.2f} ms  p95 {latency['p95']:9.2f} ms  "
+                              f"p99 {latency['p99']:9.2f} ms  {result['verdicts']}")
+        finally:
+            os.chdir(cwd)
+
+    params = {"cases": names, "runners": runners, "concurrency": levels,
+              "submissions": args.submissions, "tests": args.tests, "time_limit": args.time_limit,
+              "test_workers": args.test_workers, "cpu_count": os.cpu_count()}
+    return make_report(params, results, spawn_overhead_ms=spawn, compare_cost_ms=compare)
+
+
+def parse_args(argv=None):
+    cases = tuple(make_cases(1))
+    parser = argparse.ArgumentParser(description="TaskChecker throughput benchmark")
+    parser.add_argument("--cases", default=",".join(cases),
+                        help=f"comma separated subset of {', '.join(cases)}")
+    parser.add_argument("--runners", default=f"{RUNNER_PROCESS},{RUNNER_FORKSERVER}",
+                        help="comma separated runners (process, forkserver)")
+    parser.add_argument("--concurrency", default="1,2,4", help="comma separated numbers of judge threads")
+    parser.add_argument("--submissions", type=int, default=20, help="submissions per case, runner and level")
+    parser.add_argument("--tests", type=int, default=5, help="tests per task")
+    parser.add_argument("--time-limit", type=float, default=1, help="time limit per test in seconds")
+    parser.add_argument("--test-workers", type=int, default=1, help="tests of one submission run at once")
+    parser.add_argument("--spawn-samples", type=int, default=50, help="empty program runs per runner")
+    parser.add_argument("--compare-repeats", type=int, default=20, help="comparisons per case and mode")
+    parser.add_argument("--output", help="file for JSON results (stdout if omitted)")
+    args = parser.parse_args(argv)
+    unknown = set(args.cases.split(",")) - set(cases)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    unknown = set(args.runners.split(",")) - {RUNNER_PROCESS, RUNNER_FORKSERVER}
+    if unknown:
+        parser.error(f"unknown runners: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    save(run(args), args.output)
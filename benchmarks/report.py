@@ -0,0 +1,61 @@
+"""
+Общие функции бенчмарков: перцентили задержек и сохранение результатов в JSON.
+"""
+import datetime
+import json
+import math
+import platform
+import subprocess
+
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль по ближайшему рангу, values отсортирован"""
+    if not values:
+        return 0
+    rank = math.ceil(p / 100 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def latency_ms(latencies: list) -> dict:
+    """
+    :param latencies: задержки в секундах
+    :return: среднее, p50, p95, p99 и максимум в миллисекундах
+    """
+    latencies = sorted(latencies)
+    return {
+        "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0,
+        "p50": round(percentile(latencies, 50) * 1000, 3),
+        "p95": round(percentile(latencies, 95) * 1000, 3),
+        "p99": round(percentile(latencies, 99) * 1000, 3),
+        "max": round(latencies[-1] * 1000, 3) if latencies else 0
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_report(params: dict, results: list, **extra) -> dict:
+    """Результаты вместе с коммитом, датой и версией Python, чтобы их можно было сравнивать"""
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        **extra,
+        "params": params,
+        "results": results
+    }
+
+
+def save(report: dict, output: str = None):
+    """Сохраняет результаты в файл output или печатает их, если файл не указан"""
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {output}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,39 @@
+import hashlib
+from threading import Lock
+
+from caching import LRUCache
+
+
+class CatalogCache(LRUCache):
+    """
+    Кэш готовых ответов GET /courses: (ETag, тело ответа).
+    Отдельные записи для обычных и привилегированных (/c) пользователей
+    и для каждого набора fields/expand и страницы
+    """
+
+    def __init__(self, max_size: int, ttl: float = None):
+        super().__init__(max_size, ttl)
+        # Номер версии каталога входит в ключ: ответ, собранный до изменения
+        # курсов, сохранится под старой версией и уже не найдётся
+        self.version = 0
+        self._version_lock = Lock()
+
+    def make_key(self, privileged: bool, args) -> tuple:
+        """
+        :param privileged: пользователь видит непубличные курсы
+        :param args: параметры запроса (request.args)
+        """
+        return (self.version, privileged, args.get("fields", ""), args.get("expand", ""),
+                args.get("cursor", ""), args.get("limit", ""))
+
+    def store(self, key: tuple, body: bytes) -> tuple:
+        """:return: (ETag, тело ответа)"""
+        entry = (hashlib.sha1(body).hexdigest(), body)
+        self.put(key, entry)
+        return entry
+
+    def invalidate(self):
+        """Вызывается после любого изменения курсов, уроков, заданий и ссылок"""
+        with self._version_lock:
+            self.version += 1
+        self.clear()
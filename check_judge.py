@@ -0,0 +1,103 @@
+"""
+Проверка вердиктов TaskChecker на решениях, которые легко засчитать по ошибке.
+
+Скрипт проверяет синтетические решения так же, как потоки JudgePool, и завершается
+с кодом 1, если какой-то вердикт не совпал с ожидаемым. Вердикты не пишутся в базу,
+поэтому база не нужна. Решения запускаются во временной папке.
+
+Запуск: python check_judge.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+from task_checking import TaskChecker
+
+ANSWER = {"tests": [{"input": str(i), "output": str(i)} for i in range(1, 4)]}
+
+
+class Recorder:
+    """Заменяет VerdictWriter: запоминает вердикт вместо записи в базу"""
+
+    def __init__(self):
+        self.result = None
+
+    def submit(self, result):
+        self.result = result
+
+
+def judge(code: str, tests: dict = ANSWER, cmd: str = sys.executable, **kwargs):
+    """
+    :return: (вердикт, VerdictResult)
+    :raises Exception: если проверка упала (JudgePool ставит такому решению "Internal error")
+    """
+    recorder = Recorder()
+    checker = TaskChecker(code, 1, cmd, tests, "", uuid.uuid4(), writer=recorder, **kwargs)
+    try:
+        return checker(None), recorder.result
+    finally:
+        checker.cleanup()
+
+
+def expect_error(**kwargs) -> str:
+    """Проверка должна упасть, а не закончиться вердиктом"""
+    try:
+        verdict, _ = judge("print(input())", **kwargs)
+    except Exception:
+        return None
+    return f"verdict {verdict!r} instead of an error"
+
+
+def expect_verdict(code: str, expected: str, status: str = None, **kwargs) -> str:
+    """Вердикт должен начинаться с expected, а последний тест - получить статус status"""
+    verdict, result = judge(code, **kwargs)
+    if not (verdict or "").startswith(expected):
+        return f"verdict {verdict!r}, expected {expected!r}"
+    if status is not None and result.tests[-1].status != status:
+        return f"test status {result.tests[-1].status!r}, expected {status!r}"
+    return None
+
+
+def checks() -> list:
+    """(название, функция, которая возвращает описание ошибки или None)"""
+    return [
+        ("missing interpreter, sequential tests",
+         lambda: expect_error(cmd="/nonexistent/python", test_workers=1)),
+        ("missing interpreter, parallel tests",
+         lambda: expect_error(cmd="/nonexistent/python", test_workers=3)),
+        ("correct output, then exit code 3",
+         lambda: expect_verdict("import os; print(input(), flush=True); os._exit(3)",
+                                "Runtime error (exit code 3) on test 1", "RE")),
+        ("correct output, then SIGKILL",
+         lambda: expect_verdict("import os, signal; print(input(), flush=True); os.kill(os.getpid(), signal.SIGKILL)",
+                                "Runtime error (signal SIGKILL) on test 1", "RE")),
+        ("wrong output stops the solution early",
+         lambda: expect_verdict("import time; print('x', flush=True); time.sleep(5)", "Error:", "WA")),
+        ("correct output", lambda: expect_verdict("print(input())", "OK", "OK")),
+    ]
+
+
+def main() -> int:
+    failed = 0
+    cwd = os.getcwd()
+    # TaskChecker пишет решения в tests/ относительно текущей папки
+    with tempfile.TemporaryDirectory(prefix="check-judge-") as workdir:
+        os.chdir(workdir)
+        try:
+            for name, check in checks():
+                error = check()
+                if error:
+                    failed += 1
+                    print(f"FAIL {name}: {error}")
+                else:
+                    print(f"ok   {name}")
+        finally:
+            os.chdir(cwd)
+
+    print(f"{failed} checks failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Проверка количества SQL-запросов в обработчиках.
+
+Скрипт заполняет базу тестовыми данными, вызывает обработчики через app.test_client()
+и завершается с кодом 1, если какой-то из них выполнил больше SQL-запросов, чем указано
+в BUDGETS (заголовок X-Query-Count). Перед каждым запросом кэши пользователей, ролей
+и курсов очищаются, поэтому считается худший случай. Курсов, уроков, заданий и решений
+несколько, так что загрузка связей по одной записи (N+1) сразу превышает лимит.
+
+Запуск: python check_query_counts.py [--db-url URL]
+По умолчанию используется SQLite в памяти. С --db-url данные остаются в базе,
+поэтому база должна быть одноразовой.
+"""
+import argparse
+import os
+import sys
+import uuid
+
+import sqlalchemy as sa
+
+COURSES = 3
+LESSONS_PER_COURSE = 4
+TASKS_PER_LESSON = 3
+SOLVES_PER_TASK = 2
+PASSWORD = "counts-password"
+
+# Обработчик -> сколько SQL-запросов он может выполнить с пустыми кэшами
+# (пользователь из токена - 2 запроса: пользователь с ролью и его курсы, версия роли - ещё 1)
+BUDGETS = {
+    "POST /reg": 7,
+    "POST /login": 2,
+    "GET /courses": 4,
+    "GET /courses (expand=lessons.tasks)": 6,
+    "GET /courses/<id>": 7,
+    "GET /courses/attend/<id>": 6,
+    "GET /lessons/<id>": 7,
+    "GET /tasks/<id>": 5,
+    "GET /user/courses/<id>": 5,
+    "POST /tasks/<id>": 5,
+    "GET /tasks/<id>/solves": 5,
+    "GET /solves/<id>": 5,
+    "GET /auth": 4,
+}
+
+
+def seed(sess) -> dict:
+    """
+    Заполняет базу и возвращает ID записей, к которым обращаются запросы.
+    Ученик записан на первый курс и решал все его задания
+    """
+    from data.__all_models import (Role, User, Language, Course, Lesson, Link,
+                                   Task, Solve, TestResult, Attendance)
+
+    rows = {name: [] for name in ("roles", "users", "languages", "courses", "lessons",
+                                  "links", "tasks", "solves", "test_results", "attendance")}
+
+    def add(table, **values):
+        values.setdefault("id", uuid.uuid4())
+        rows[table].append(values)
+        return values["id"]
+
+    probe = User("", "", "", None)
+    probe.generate_hash_password(PASSWORD)
+
+    add("roles", title="user", permissions="/Ca /Ua")
+    role_id = add("roles", title="student", permissions="")
+    language_id = add("languages", name="Python", path=sys.executable, options="",
+                      runner="process", extension="py")
+    user_id = add("users", name="student", login="student", email="student@example.com",
+                  password=probe.password, role_id=role_id)
+
+    course_ids, lesson_ids, task_ids = [], [], []
+    for i in range(COURSES):
+        course_ids.append(add("courses", name=f"course {i}", description="", language_id=language_id,
+                              is_public=True, author_id=user_id))
+        for j in range(LESSONS_PER_COURSE):
+            lesson_ids.append(add("lessons", course_id=course_ids[-1], name=f"lesson {j}",
+                                  description="", order=j))
+            add("links", lesson_id=lesson_ids[-1], title="docs", link="https://docs.python.org")
+            for k in range(TASKS_PER_LESSON):
+                task_ids.append(add("tasks", lesson_id=lesson_ids[-1], name=f"task {k}", task_condition="",
+                                    tests={"tests": [{"input": "1", "output": "1"}]}, time_limit=1, order=k))
+
+    add("attendance", user_id=user_id, course_id=course_ids[0])
+    solve_ids = []
+    for task_id in task_ids[:LESSONS_PER_COURSE * TASKS_PER_LESSON]:
+        for n in range(SOLVES_PER_TASK):
+            solve_ids.append(add("solves", task_id=task_id, user_id=user_id,
+                                 verdict="OK" if n else "Wrong answer", code="print(input())",
+                                 time=1, memory=1024))
+            for number in range(1, 3):
+                add("test_results", solve_id=solve_ids[-1], number=number, status="OK",
+                    cpu_time=1, wall_time=1, memory=1024)
+
+    for name, model in (("roles", Role), ("users", User), ("languages", Language),
+                        ("courses", Course), ("lessons", Lesson), ("links", Link),
+                        ("tasks", Task), ("solves", Solve), ("test_results", TestResult),
+                        ("attendance", Attendance)):
+        sess.execute(sa.insert(model), rows[name])
+    sess.commit()
+
+    return {"user_id": user_id, "course_id": course_ids[0], "other_course_id": course_ids[1],
+            "lesson_id": lesson_ids[0], "task_id": task_ids[0], "solve_id": solve_ids[0]}
+
+
+def make_requests(ids: dict) -> list:
+    """(название из BUDGETS, метод, путь, тело)"""
+    return [
+        ("POST /reg", "POST", "/reg",
+         {"login": "new", "password": PASSWORD, "name": "new", "email": "new@example.com"}),
+        ("POST /login", "POST", "/login", {"login": "student", "password": PASSWORD}),
+        ("GET /courses", "GET", "/courses", None),
+        ("GET /courses (expand=lessons.tasks)", "GET", "/courses?expand=language,lessons.tasks", None),
+        ("GET /courses/<id>", "GET", f"/courses/{ids['course_id']}", None),
+        ("GET /courses/attend/<id>", "GET", f"/courses/attend/{ids['other_course_id']}", None),
+        ("GET /lessons/<id>", "GET", f"/lessons/{ids['lesson_id']}", None),
+        ("GET /tasks/<id>", "GET", f"/tasks/{ids['task_id']}", None),
+        ("GET /user/courses/<id>", "GET", f"/user/courses/{ids['user_id']}", None),
+        ("POST /tasks/<id>", "POST", f"/tasks/{ids['task_id']}", {"code": f"print(input())  # {uuid.uuid4()}"}),
+        ("GET /tasks/<id>/solves", "GET", f"/tasks/{ids['task_id']}/solves", None),
+        ("GET /solves/<id>", "GET", f"/solves/{ids['solve_id']}", None),
+        ("GET /auth", "GET", "/auth", None),
+    ]
+
+
+def main(db_url: str) -> int:
+    # config читает DB_URL при импорте, поэтому main импортируется только после него
+    os.environ["DB_URL"] = db_url
+    import main as server
+
+    server.create_app()
+    sess = server.create_session()
+    try:
+        ids = seed(sess)
+    finally:
+        sess.close()
+
+    client = server.app.test_client()
+    token = client.post("/login", json={"login": "student", "password": PASSWORD}).json["jwt_access"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    failed = 0
+    for name, method, path, body in make_requests(ids):
+        for cache in (server.user_cache, server.role_cache, server.catalog_cache):
+            cache.clear()
+        response = client.open(path, method=method, json=body, headers=headers)
+        queries = int(response.headers["X-Query-Count"])
+        budget = BUDGETS[name]
+        if response.status_code >= 400:
+            failed += 1
+            print(f"FAIL {name}: status {response.status_code} {response.get_data(as_text=True)[:200]}")
+        elif queries > budget:
+            failed += 1
+            print(f"FAIL {name}: {queries} queries, budget {budget}")
+        else:
+            print(f"ok   {name}: {queries} queries, budget {budget}")
+
+    server.shutdown(timeout=0)
+    print(f"{failed} of {len(BUDGETS)} endpoints failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQL query count check")
+    parser.add_argument("--db-url", default="sqlite://",
+                        help="disposable database URL (in-memory SQLite by default)")
+    sys.exit(main(parser.parse_args().db_url))
@@ -0,0 +1,245 @@
+"""
+Проверка планов самых частых запросов.
+
+Скрипт заполняет базу тестовыми данными внутри транзакции, выполняет
+EXPLAIN для запросов обработчиков и завершается с кодом 1, если какой-то
+из них читает таблицу последовательным сканированием (Seq Scan).
+Последовательное сканирование запрещается (enable_seqscan = off), поэтому
+оно появляется в плане, только если для запроса нет подходящего индекса.
+В SQLite план берётся из EXPLAIN QUERY PLAN, а последовательное
+сканирование - это шаг "SCAN <таблица>" без индекса.
+Ещё проверяется, что курсоры постраничных списков восстанавливаются с типами
+колонок и следующая страница продолжает предыдущую.
+В конце транзакция откатывается, данные в базе не меняются.
+
+Запуск: python check_query_plans.py [количество пользователей]
+(база берётся из DB_URL или DB_*, например DB_URL=sqlite:///plans.sqlite)
+"""
+import datetime
+import json
+import random
+import sys
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from config import *
+from data.database import global_init, get_engine
+from data.__all_models import (Role, User, Language, Course, Lesson, Link,
+                               Task, Solve, TestResult, Attendance)
+from data.progress import statuses_query
+from pagination import Page, PageError
+
+COURSES = 20
+LESSONS_PER_COURSE = 10
+TASKS_PER_LESSON = 5
+SOLVES_PER_USER = 40
+COURSES_PER_USER = 4
+
+
+def seed(sess: Session, users: int) -> dict:
+    """
+    Заполняет базу и возвращает ID записей, по которым строятся запросы
+    """
+    rows = {name: [] for name in ("roles", "users", "languages", "courses", "lessons",
+                                  "links", "tasks", "solves", "test_results", "attendance")}
+
+    def add(table, **values):
+        values.setdefault("id", uuid.uuid4())
+        rows[table].append(values)
+        return values["id"]
+
+    role_id = add("roles", title="user", permissions="/c /u")
+    language_id = add("languages", name="Python", path=sys.executable, options="",
+                      runner="process", extension="py")
+    user_ids = [add("users", name=f"user {i}", login=f"plan_user_{i}",
+                    email=f"plan_user_{i}@example.com", password="-", role_id=role_id)
+                for i in range(users)]
+
+    task_ids = []
+    course_ids = []
+    for i in range(COURSES):
+        course_id = add("courses", name=f"course {i}", description="", language_id=language_id,
+                        is_public=i % 4 != 0, author_id=user_ids[0])
+        course_ids.append(course_id)
+        for j in range(LESSONS_PER_COURSE):
+            lesson_id = add("lessons", course_id=course_id, name=f"lesson {j}", description="", order=j)
+            add("links", lesson_id=lesson_id, title="docs", link="https://docs.python.org")
+            for k in range(TASKS_PER_LESSON):
+                task_ids.append(add("tasks", lesson_id=lesson_id, name=f"task {k}", task_condition="",
+                                    tests={"tests": []}, time_limit=1, order=k))
+
+    for user_id in user_ids:
+        for course_id in random.sample(course_ids, COURSES_PER_USER):
+            add("attendance", user_id=user_id, course_id=course_id)
+        for _ in range(SOLVES_PER_USER):
+            solve_id = add("solves", task_id=random.choice(task_ids), user_id=user_id,
+                           verdict=random.choice(("OK", "Error", "Time limit exceeded")),
+                           code="print(input())", time=1)
+            add("test_results", solve_id=solve_id, number=1, status="OK", cpu_time=1, wall_time=1)
+
+    for name, model in (("roles", Role), ("users", User), ("languages", Language),
+                        ("courses", Course), ("lessons", Lesson), ("links", Link),
+                        ("tasks", Task), ("solves", Solve), ("test_results", TestResult),
+                        ("attendance", Attendance)):
+        sess.execute(sa.insert(model), rows[name])
+
+    user = rows["users"][len(user_ids) // 2]
+    solve = rows["solves"][len(rows["solves"]) // 2]
+    lesson = rows["lessons"][len(rows["lessons"]) // 2]
+    return {"user": user, "course_id": course_ids[len(course_ids) // 2], "lesson_id": lesson["id"],
+            "lesson_ids": [row["id"] for row in rows["lessons"][:LESSONS_PER_COURSE]],
+            "task_id": solve["task_id"], "task_ids": task_ids[:TASKS_PER_LESSON], "solve_id": solve["id"]}
+
+
+def hot_queries(ids: dict) -> list:
+    """(название, запрос) - те же запросы, что выполняют обработчики"""
+    user = ids["user"]
+    return [
+        ("login by login or email", sa.select(User).where(
+            (User.login == user["login"]) | (User.email == user["email"]))),
+        ("registration email check", sa.select(User).where(User.email == user["email"]).limit(1)),
+        ("default role", sa.select(Role).where(Role.title == "user").limit(1)),
+        ("attendance check", sa.select(Attendance).where(
+            Attendance.user_id == user["id"], Attendance.course_id == ids["course_id"]).limit(1)),
+        ("user course ids", sa.select(Attendance.course_id).where(Attendance.user_id == user["id"])),
+        ("students of course", sa.select(Attendance.user_id).where(
+            Attendance.course_id == ids["course_id"])),
+        ("task statuses", statuses_query(user["id"], ids["task_ids"])),
+        ("solves of task (page)", sa.select(Solve).where(
+            Solve.task_id == ids["task_id"], Solve.user_id == user["id"]
+        ).order_by(Solve.created_at.desc(), Solve.id.desc()).limit(51)),
+        ("solves of user", sa.select(Solve).where(Solve.user_id == user["id"])),
+        ("solves ahead in queue", sa.select(sa.func.count(Solve.id)).where(
+            Solve.verdict == "Check", Solve.created_at < datetime.datetime.now())),
+        ("test results", sa.select(TestResult).where(
+            TestResult.solve_id == ids["solve_id"]).order_by(TestResult.number)),
+        ("lessons of course", sa.select(Lesson).where(
+            Lesson.course_id == ids["course_id"]).order_by(Lesson.order)),
+        ("lessons of courses (selectinload)", sa.select(Lesson).where(
+            Lesson.course_id.in_([ids["course_id"]]))),
+        ("tasks of lesson", sa.select(Task).where(
+            Task.lesson_id == ids["lesson_id"]).order_by(Task.order)),
+        ("tasks of lessons (selectinload)", sa.select(Task).where(Task.lesson_id.in_(ids["lesson_ids"]))),
+        ("links of lessons (selectinload)", sa.select(Link).where(Link.lesson_id.in_(ids["lesson_ids"]))),
+        ("courses of user (page)", sa.select(Course).join(
+            Attendance, Attendance.course_id == Course.id
+        ).where(Attendance.user_id == user["id"]).order_by(Course.name, Course.id).limit(51)),
+        ("courses of author", sa.select(Course).where(Course.author_id == user["id"])),
+    ]
+
+
+def paged_queries(ids: dict) -> list:
+    """(название, запрос без порядка, колонки курсора, по убыванию) - списки обработчиков"""
+    user = ids["user"]
+    return [
+        ("solves of task", sa.select(Solve).where(Solve.task_id == ids["task_id"]),
+         (Solve.created_at, Solve.id), True),
+        ("courses of user", sa.select(Course).join(Attendance, Attendance.course_id == Course.id).where(
+            Attendance.user_id == user["id"]), (Course.name, Course.id), False),
+        ("public courses", sa.select(Course).where(Course.is_public), (Course.name, Course.id), False),
+    ]
+
+
+def check_cursor(sess: Session, query, columns: tuple, descending: bool) -> str:
+    """
+    Листает список по одной строке и сравнивает с полным списком
+    :return: описание ошибки или None
+    """
+    page = Page({}, columns, descending, max_limit=1000)
+    expected = sess.scalars(page.apply(query)).all()[:page.limit]
+    if len(expected) < 2:
+        return "not enough rows to check the cursor"
+    received, cursor = [], None
+    while True:
+        try:
+            page = Page({"limit": 1, **({"cursor": cursor} if cursor else {})}, columns, descending)
+        except PageError as e:
+            return f"cursor {cursor!r} is rejected: {e}"
+        rows, cursor = page.split(sess.scalars(page.apply(query)).all())
+        received.extend(rows)
+        if cursor is None or len(received) > len(expected):
+            break
+    if [row.id for row in received] != [row.id for row in expected]:
+        return f"pages give {len(received)} rows instead of {len(expected)}"
+    return None
+
+
+def explain(conn, statement) -> dict:
+    sql = statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def seq_scans(plan: dict) -> list:
+    """:return: таблицы, которые план читает последовательным сканированием"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+def sqlite_scans(conn, statement) -> list:
+    """:return: таблицы, которые SQLite читает целиком, не используя индекс"""
+    sql = statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    found = []
+    for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row[-1]
+        # "SCAN users USING INDEX ..." - обход по индексу, "SCAN users" - вся таблица
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            found.append(detail.split()[1])
+    return found
+
+
+def full_scans(conn, statement) -> list:
+    if conn.dialect.name == "sqlite":
+        return sqlite_scans(conn, statement)
+    return seq_scans(explain(conn, statement))
+
+
+def main(users: int) -> int:
+    global_init(db_password, db_username, db_address, db_name, url=db_url)
+    engine = get_engine()
+
+    failed = 0
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            sess = Session(bind=conn)
+            ids = seed(sess, users)
+            sess.flush()
+            # SQLite без статистики (ANALYZE) считает таблицы большими и выбирает индекс, если он есть
+            if conn.dialect.name == "postgresql":
+                conn.exec_driver_sql("ANALYZE")
+                conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+            queries = hot_queries(ids)
+            for name, statement in queries:
+                tables = full_scans(conn, statement)
+                if tables:
+                    failed += 1
+                    print(f"FAIL {name}: Seq Scan on {', '.join(tables)}")
+                else:
+                    print(f"ok   {name}")
+
+            for name, query, columns, descending in paged_queries(ids):
+                error = check_cursor(sess, query, columns, descending)
+                if error:
+                    failed += 1
+                    print(f"FAIL {name} pages: {error}")
+                else:
+                    print(f"ok   {name} pages")
+        finally:
+            transaction.rollback()
+
+    print(f"{failed} checks failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,253 @@
+"""
+Потоковое сравнение вывода решения с ответом.
+
+Компаратор получает вывод кусками, пока программа работает (feed),
+и просит остановить её, как только вывод разошёлся с ответом
+или стал больше ответа с запасом. Полный вывод в памяти не хранится.
+"""
+import re
+
+OUTPUT_MARGIN = 4096  # Насколько вывод может быть длиннее ответа (в байтах, плюс 10% ответа)
+PREVIEW_LIMIT = 200  # Сколько символов строки показывать в вердикте
+
+COMPARE_EXACT = "exact"  # вывод без пробелов по краям совпадает с ответом
+COMPARE_LINES = "lines"  # строки совпадают без учёта пробелов в конце строк и пустых строк в конце
+COMPARE_TOKENS = "tokens"  # совпадают последовательности слов, пробелы и переводы строк не важны
+COMPARE_MODES = (COMPARE_EXACT, COMPARE_LINES, COMPARE_TOKENS)
+
+_TOKEN = re.compile(rb"\S+")
+
+
+def _preview(data: bytes) -> str:
+    text = data[:PREVIEW_LIMIT].decode("utf8", errors="replace")
+    return text + "..." if len(data) > PREVIEW_LIMIT else text
+
+
+class StreamingComparator:
+    def __init__(self, expected: str, max_size: int = None):
+        """
+        :param expected: правильный ответ на тест
+        :param max_size: максимальный размер вывода в байтах, даже если ответ большой
+        """
+        self.expected = self.normalize(expected).encode("utf8")
+        self.limit = len(self.expected) + OUTPUT_MARGIN + len(self.expected) // 10
+        if max_size is not None:
+            self.limit = min(self.limit, max_size)
+        self.size = 0
+        self.overflow = False
+        self.mismatch = None  # описание расхождения
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        :param chunk: очередной кусок вывода
+        :return: False, если программу нужно остановить
+        """
+        if self.mismatch is not None or self.overflow:
+            return False
+        self.size += len(chunk)
+        if self.size > self.limit:
+            self.overflow = True
+            return False
+        self._feed(chunk)
+        return self.mismatch is None
+
+    def finish(self):
+        """
+        Вызывается после завершения программы
+        :return: описание расхождения или None, если вывод совпал с ответом
+        """
+        if self.mismatch is None and not self.overflow:
+            self._finish()
+        return self.mismatch
+
+    @staticmethod
+    def normalize(expected: str) -> str:
+        return expected.strip()
+
+    def _feed(self, chunk: bytes):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _line_at(self, pos: int):
+        """:return: (номер строки ответа с 0, сама строка) для позиции pos в ответе"""
+        start = self.expected.rfind(b"\n", 0, pos) + 1
+        end = self.expected.find(b"\n", pos)
+        if end == -1:
+            end = len(self.expected)
+        return self.expected.count(b"\n", 0, start), self.expected[start:end]
+
+
+class ExactComparator(StreamingComparator):
+    """Вывод без пробельных символов по краям должен побайтно совпасть с ответом"""
+
+    def __init__(self, expected: str, max_size: int = None):
+        super().__init__(expected, max_size)
+        self._pos = 0  # сколько байт ответа уже совпало
+        self._started = False  # пробелы в начале вывода уже пропущены
+        self._line = b""  # начало текущей строки вывода (для вердикта)
+
+    def _feed(self, chunk: bytes):
+        if not self._started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self._started = True
+
+        rest = len(self.expected) - self._pos
+        head, tail = chunk[:rest], chunk[rest:]
+
+        if head != self.expected[self._pos:self._pos + len(head)]:
+            for k, byte in enumerate(head):
+                if byte != self.expected[self._pos + k]:
+                    break
+            self._remember(head[:k])
+            self._mismatch_at(self._pos + k, head[k:])
+            return
+
+        self._pos += len(head)
+        self._remember(head)
+
+        if tail.strip():
+            # Ответ кончился, а в выводе есть что-то кроме пробелов
+            lines = self.expected.count(b"\n") + 1
+            self.mismatch = f"Expected {lines} lines, got more instead."
+
+    def _finish(self):
+        if self._pos < len(self.expected):
+            self._mismatch_at(self._pos, b"")
+
+    def _remember(self, data: bytes):
+        newline = data.rfind(b"\n")
+        if newline != -1:
+            self._line = data[newline + 1:newline + 1 + PREVIEW_LIMIT + 1]
+        elif len(self._line) <= PREVIEW_LIMIT:
+            self._line += data[:PREVIEW_LIMIT + 1]
+
+    def _mismatch_at(self, pos: int, rest: bytes):
+        number, line = self._line_at(pos)
+        got = self._line + rest.split(b"\n", 1)[0]
+        self.mismatch = f"Expected {_preview(line)} in line {number}," \
+                        f" got {_preview(got)} instead."
+
+
+class LinesComparator(StreamingComparator):
+    """Строки сравниваются без пробелов в конце, пустые строки в конце не важны"""
+
+    def __init__(self, expected: str, max_size: int = None):
+        super().__init__(expected, max_size)
+        # Начало следующей строки ответа (за концом ответа, если строк не осталось)
+        self._expected_pos = 0 if self.expected else 1
+        self._number = 0  # номер следующей строки
+        self._line = b""  # незаконченная строка вывода
+        self._blank = 0  # сколько пустых строк вывода отложено
+
+    @staticmethod
+    def normalize(expected: str) -> str:
+        return expected.rstrip()
+
+    def _feed(self, chunk: bytes):
+        lines = (self._line + chunk).split(b"\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._compare(line)
+            if self.mismatch is not None:
+                return
+
+    def _finish(self):
+        self._compare(self._line)
+        if self.mismatch is None and self._expected_pos <= len(self.expected):
+            number, line = self._line_at(self._expected_pos)
+            self.mismatch = f"Expected {_preview(line)} in line {number}, got nothing instead."
+
+    def _next_expected(self):
+        if self._expected_pos > len(self.expected):
+            return None
+        end = self.expected.find(b"\n", self._expected_pos)
+        if end == -1:
+            end = len(self.expected)
+        line = self.expected[self._expected_pos:end]
+        self._expected_pos = end + 1
+        return line.rstrip()
+
+    def _compare(self, line: bytes):
+        line = line.rstrip()
+        if not line:
+            # Пустые строки сравним, только когда за ними будет что-то ещё
+            self._blank += 1
+            return
+
+        for _ in range(self._blank):
+            self._compare_line(b"")
+            if self.mismatch is not None:
+                return
+        self._blank = 0
+        self._compare_line(line)
+
+    def _compare_line(self, line: bytes):
+        expected = self._next_expected()
+        if expected is None:
+            lines = self.expected.count(b"\n") + 1 if self.expected else 0
+            self.mismatch = f"Expected {lines} lines, got more instead."
+        elif line != expected:
+            self.mismatch = f"Expected {_preview(expected)} in line {self._number}," \
+                            f" got {_preview(line)} instead."
+        self._number += 1
+
+
+class TokensComparator(StreamingComparator):
+    """Сравниваются только слова (последовательности непробельных символов)"""
+
+    def __init__(self, expected: str, max_size: int = None):
+        super().__init__(expected, max_size)
+        self._tokens = _TOKEN.finditer(self.expected)
+        self._number = 0
+        self._partial = b""  # слово, которое могло продолжиться в следующем куске
+
+    def _feed(self, chunk: bytes):
+        data = self._partial + chunk
+        tokens = data.split()
+        self._partial = b""
+        if tokens and not data[-1:].isspace():
+            self._partial = tokens.pop()
+        for token in tokens:
+            self._compare(token)
+            if self.mismatch is not None:
+                return
+
+    def _finish(self):
+        if self._partial:
+            self._compare(self._partial)
+        if self.mismatch is None:
+            expected = next(self._tokens, None)
+            if expected is not None:
+                self.mismatch = f"Expected {_preview(expected.group())} in token {self._number}," \
+                                f" got nothing instead."
+
+    def _compare(self, token: bytes):
+        expected = next(self._tokens, None)
+        if expected is None:
+            self.mismatch = "Expected fewer tokens, got more instead."
+        elif token != expected.group():
+            self.mismatch = f"Expected {_preview(expected.group())} in token {self._number}," \
+                            f" got {_preview(token)} instead."
+        self._number += 1
+
+
+_COMPARATORS = {
+    COMPARE_EXACT: ExactComparator,
+    COMPARE_LINES: LinesComparator,
+    COMPARE_TOKENS: TokensComparator
+}
+
+
+def make_comparator(expected: str,
+                    mode: str = COMPARE_EXACT,
+                    max_size: int = None) -> StreamingComparator:
+    """
+    :param expected: правильный ответ на тест
+    :param mode: COMPARE_EXACT, COMPARE_LINES или COMPARE_TOKENS
+    :param max_size: максимальный размер вывода в байтах
+    """
+    return _COMPARATORS.get(mode, ExactComparator)(expected, max_size)
@@ -3,7 +3,48 @@ from os import environ
 
 config_ = {**dotenv_values(), **environ}
 
-db_password = config_["DB_PASSWORD"]
-db_username = config_["DB_USERNAME"]
-db_address = config_["DB_ADDRESS"]  # путь до базы данных
-db_name = config_["DB_NAME"]  # путь до базы данных
+db_url = config_.get("DB_URL")  # адрес базы целиком (например, sqlite:///pytry.sqlite), тогда DB_PASSWORD и другие не нужны
+db_password = config_["DB_PASSWORD"] if not db_url else config_.get("DB_PASSWORD")
+db_username = config_["DB_USERNAME"] if not db_url else config_.get("DB_USERNAME")
+db_address = config_["DB_ADDRESS"] if not db_url else config_.get("DB_ADDRESS")  # путь до базы данных
+db_name = config_["DB_NAME"] if not db_url else config_.get("DB_NAME")  # путь до базы данных
+db_pool_size = int(config_.get("DB_POOL_SIZE", 10))  # сколько соединений с базой держать открытыми
+db_max_overflow = int(config_.get("DB_MAX_OVERFLOW", 20))  # сколько соединений можно открыть сверх DB_POOL_SIZE
+db_pool_timeout = float(config_.get("DB_POOL_TIMEOUT", 30))  # сколько секунд ждать свободное соединение
+db_pool_recycle = int(config_.get("DB_POOL_RECYCLE", 1800))  # через сколько секунд переоткрывать соединение
+db_pool_pre_ping = config_.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")  # проверять соединение перед выдачей
+
+judge_workers = int(config_.get("JUDGE_WORKERS", 4))  # количество одновременных проверок
+judge_queue_size = int(config_.get("JUDGE_QUEUE_SIZE", 200))  # максимальная длина очереди проверки
+judge_output_limit = int(config_.get("JUDGE_OUTPUT_LIMIT", 16 * 1024 * 1024))  # лимит вывода решения в байтах
+judge_test_workers = int(config_.get("JUDGE_TEST_WORKERS", 1))  # сколько тестов одного решения запускать одновременно
+judge_artifact_dir = config_.get("JUDGE_ARTIFACT_DIR", "artifacts")  # папка кэша скомпилированных решений
+judge_artifact_cache_size = int(config_.get("JUDGE_ARTIFACT_CACHE_SIZE", 500))  # сколько решений хранить в кэше
+judge_compile_timeout = int(config_.get("JUDGE_COMPILE_TIMEOUT", 30))  # лимит времени на компиляцию в секундах
+verdict_cache_size = int(config_.get("VERDICT_CACHE_SIZE", 10000))  # сколько вердиктов хранить в кэше
+solve_events_timeout = int(config_.get("SOLVE_EVENTS_TIMEOUT", 30))  # сколько держать поток /solves/<id>/events, в секундах (потом клиент подключается заново)
+solve_events_keepalive = int(config_.get("SOLVE_EVENTS_KEEPALIVE", 15))  # как часто слать keepalive в поток, в секундах
+solve_events_poll = float(config_.get("SOLVE_EVENTS_POLL", 1))  # как часто проверять вердикт в базе (решение может проверять другой процесс), в секундах
+solve_events_retry = int(config_.get("SOLVE_EVENTS_RETRY", 3))  # через сколько секунд клиенту переподключаться к потоку
+judge_wall_factor = float(config_.get("JUDGE_WALL_FACTOR", 2))  # во сколько раз астрономическое время может превышать лимит
+catalog_cache_size = int(config_.get("CATALOG_CACHE_SIZE", 64))  # сколько вариантов списка курсов хранить в кэше
+catalog_cache_ttl = float(config_.get("CATALOG_CACHE_TTL", 60))  # время жизни кэша курсов в секундах (изменения из других процессов)
+user_cache_size = int(config_.get("USER_CACHE_SIZE", 10000))  # сколько пользователей хранить в кэше
+user_cache_ttl = float(config_.get("USER_CACHE_TTL", 30))  # время жизни пользователя в кэше в секундах
+role_cache_ttl = float(config_.get("ROLE_CACHE_TTL", 30))  # через сколько секунд токены со старыми полномочиями роли перестают работать
+page_size = int(config_.get("PAGE_SIZE", 50))  # размер страницы списков по умолчанию
+max_page_size = int(config_.get("MAX_PAGE_SIZE", 200))  # максимальный размер страницы (параметр limit)
+verdict_batch_size = int(config_.get("VERDICT_BATCH_SIZE", 100))  # сколько вердиктов записывать одной транзакцией
+verdict_batch_interval = float(config_.get("VERDICT_BATCH_INTERVAL", 0.005))  # сколько секунд собирать вердикты перед записью
+web_bind = config_.get("WEB_BIND", "0.0.0.0:5000")  # адрес, на котором gunicorn принимает запросы
+web_workers = int(config_.get("WEB_WORKERS", 2))  # количество процессов gunicorn
+web_threads = int(config_.get("WEB_THREADS", 8))  # потоков обработки запросов в каждом процессе
+solve_events_streams = int(config_.get("SOLVE_EVENTS_STREAMS", max(web_threads // 2, 1)))  # сколько потоков /solves/<id>/events держать одновременно в процессе
+shutdown_timeout = float(config_.get("SHUTDOWN_TIMEOUT", 30))  # сколько секунд при остановке ждать проверку решений из очереди
+debug = config_.get("DEBUG", "false").lower() in ("1", "true", "yes")  # режим отладки Flask (python main.py)
+password_method = config_.get("PASSWORD_METHOD", "pbkdf2:sha256")  # алгоритм и стоимость хэша паролей (например, pbkdf2:sha256:600000)
+password_salt_length = int(config_.get("PASSWORD_SALT_LENGTH", 16))  # длина соли хэша паролей
+password_workers = int(config_.get("PASSWORD_WORKERS", 2))  # процессов для хэширования паролей (0 - в потоке запроса)
+picture_dir = config_.get("PICTURE_DIR", "static/pictures")  # папка картинок курсов
+picture_sizes = tuple(int(i) for i in config_.get("PICTURE_SIZES", "1200,480,160").split(","))  # размеры уменьшенных копий картинок (большая сторона в пикселях)
+picture_quality = int(config_.get("PICTURE_QUALITY", 80))  # качество WebP для картинок (0-100)
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, orm, ForeignKey
-from sqlalchemy.dialects.postgresql import (UUID, TEXT, DATE,
-                                            JSON, BOOLEAN, BIGINT, INTEGER)
+from sqlalchemy import (Column, orm, ForeignKey, Index,
+                        Text, Date, DateTime, JSON, Boolean, BigInteger, Integer)
 from werkzeug.security import generate_password_hash, check_password_hash
-from .database import Base
+from .database import Base, GUID
+from permissions import parse, has
 import datetime
 import uuid
 
@@ -10,58 +10,61 @@ import uuid
 class Language(Base):
     __tablename__ = "languages"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    name = Column(TEXT, nullable=False)
-    path = Column(TEXT, nullable=False)
-    options = Column(TEXT)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    name = Column(Text, nullable=False)
+    path = Column(Text, nullable=False)
+    options = Column(Text)
+    runner = Column(Text, default="process")  # Способ запуска решений (смотри в Readme)
+    extension = Column(Text, default="py")  # Расширение файла с кодом
 
     courses = orm.relationship("Course",
                                back_populates="language",
-                               cascade="all, delete",
-                               lazy="subquery")
+                               cascade="all, delete")
 
     def __init__(self,
                  name: str,
                  path: str,
-                 options: str = ""):
+                 options: str = "",
+                 runner: str = "process",
+                 extension: str = "py"):
         """
         :param name: Название языка программирования
         :param path: путь до сервера, на котором выполняется тестирование
-        :param options: опции скрипта запуска
+            (для runner="compiled" - путь до компилятора)
+        :param options: опции скрипта запуска (для runner="compiled" - опции компилятора)
+        :param runner: способ запуска решений ("process", "forkserver" или "compiled")
+        :param extension: расширение файла с кодом
         """
         self.name = name
         self.path = path
         self.options = options
-
-    def to_json(self) -> dict:
-        return {
-            "id": self.id,
-            "name": self.name
-        }
+        self.runner = runner
+        self.extension = extension
 
 
 class Course(Base):
     __tablename__ = "courses"
+    __table_args__ = (Index("ix_courses_name_id", "name", "id"),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    name = Column(TEXT, nullable=False)
-    description = Column(TEXT, nullable=False)
-    pic = Column(TEXT)  # Путь до картинки
-    language_id = Column(UUID(as_uuid=True), ForeignKey("languages.id"))
-    is_public = Column(BOOLEAN, default=True, nullable=False)
-    author_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    name = Column(Text, nullable=False)
+    description = Column(Text, nullable=False)
+    pic = Column(Text)  # Путь до картинки
+    pic_variants = Column(JSON)  # Уменьшенные копии картинки: {размер: путь}
+    language_id = Column(GUID, ForeignKey("languages.id"), index=True)
+    is_public = Column(Boolean, default=True, nullable=False)
+    author_id = Column(GUID, ForeignKey("users.id"), index=True)
 
     language = orm.relationship("Language")
     author = orm.relationship("User")
     lessons = orm.relationship("Lesson",
                                back_populates="course",
-                               cascade="all, delete",
-                               lazy="subquery")
+                               cascade="all, delete")
     users = orm.relationship("User", secondary="users_to_courses",
-                             backref="users",
-                             lazy="subquery")
-    pictures = orm.relationship("Picture", back_populates="course",
-                                lazy="subquery")
+                             back_populates="courses")
+    pictures = orm.relationship("Picture",
+                                back_populates="course",
+                                cascade="all, delete")
 
     def __init__(self, name: str,
                  description: str,
@@ -89,64 +92,49 @@ class Course(Base):
                 return True
         return False
 
-    def to_json(self) -> dict:
-        return {
-            "name": self.name,
-            "description": self.description,
-            "pic": self.pic,
-            "id": self.id,
-            "language": self.language.to_json(),
-            "is_public": self.is_public,
-            "lessons": [lesson.to_json() for lesson in self.lessons]
-        }
-
 
 class Picture(Base):
     __tablename__ = "pictures"
+    __table_args__ = (Index("ix_pictures_course_order", "course_id", "order"),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id"))
-    path = Column(TEXT, nullable=False)
-    order = Column(INTEGER, nullable=False)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    course_id = Column(GUID, ForeignKey("courses.id"))
+    path = Column(Text, nullable=False)
+    order = Column(Integer, nullable=False)
+    variants = Column(JSON)  # Уменьшенные копии картинки: {размер: путь}
 
-    course = orm.relationship("Course")
+    course = orm.relationship("Course", back_populates="pictures")
 
-    def __init__(self, course_id: uuid.UUID, path: str, order: int):
+    def __init__(self, course_id: uuid.UUID, path: str, order: int, variants: dict = None):
         """
         :param course_id: ID курса
         :param path: Путь до картинки
         :param order: Порядок картинок (число >= 0)
+        :param variants: Уменьшенные копии картинки {размер: путь}
         """
         self.course_id = course_id
         self.path = path
         self.order = order
-
-    def to_json(self):
-        return {
-            "id": self.id,
-            "path": self.path,
-            "order": self.order
-        }
+        self.variants = variants
 
 
 class Lesson(Base):
     __tablename__ = "lessons"
+    __table_args__ = (Index("ix_lessons_course_order", "course_id", "order"),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id"))
-    name = Column(TEXT)
-    description = Column(TEXT)
-    order = Column(INTEGER, nullable=False, default=0)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    course_id = Column(GUID, ForeignKey("courses.id"))
+    name = Column(Text)
+    description = Column(Text)
+    order = Column(Integer, nullable=False, default=0)
 
     course = orm.relationship("Course")
     links = orm.relationship("Link",
                              back_populates="lesson",
-                             cascade="all, delete",
-                             lazy="subquery")
+                             cascade="all, delete")
     tasks = orm.relationship("Task",
                              back_populates="lesson",
-                             cascade="all, delete",
-                             lazy="subquery")
+                             cascade="all, delete")
 
     def __init__(self, name: str, description: str, course_id: uuid.UUID, order: int):
         """
@@ -160,24 +148,14 @@ class Lesson(Base):
         self.course_id = course_id
         self.order = order
 
-    def to_json(self) -> dict:
-        return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            "tasks": [task.to_json() for task in self.tasks],
-            "links": [link.to_json() for link in self.links],
-            "order": self.order
-        }
-
 
 class Link(Base):
     __tablename__ = "useful_links"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    lesson_id = Column(UUID(as_uuid=True), ForeignKey("lessons.id"))
-    title = Column(TEXT)
-    link = Column(TEXT)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    lesson_id = Column(GUID, ForeignKey("lessons.id"), index=True)
+    title = Column(Text)
+    link = Column(Text)
 
     lesson = orm.relationship("Lesson")
 
@@ -191,22 +169,15 @@ class Link(Base):
         self.lesson_id = lesson_id
         self.title = title
 
-    def to_json(self) -> dict:
-        return {
-            "link": self.link,
-            "title": self.title,
-        }
-
 
 class TaskType(Base):
     __tablename__ = "task_types"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    title = Column(TEXT, nullable=False)
-    format = Column(TEXT, nullable=False)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    title = Column(Text, nullable=False)
+    format = Column(Text, nullable=False)
 
-    tasks = orm.relationship("Task", back_populates="task_type",
-                             lazy="subquery")
+    tasks = orm.relationship("Task", back_populates="task_type")
 
     def __init__(self, title: str, _format: str):
         """
@@ -216,32 +187,25 @@ class TaskType(Base):
         self.title = title
         self.format = _format
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "format": self.format
-        }
-
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (Index("ix_tasks_lesson_order", "lesson_id", "order"),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    lesson_id = Column(UUID(as_uuid=True), ForeignKey("lessons.id"))
-    name = Column(TEXT)
-    task_condition = Column(TEXT)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    lesson_id = Column(GUID, ForeignKey("lessons.id"))
+    name = Column(Text)
+    task_condition = Column(Text)
     tests = Column(JSON)
-    time_limit = Column(BIGINT)
-    order = Column(INTEGER)
-    type_id = Column(UUID(as_uuid=True), ForeignKey("task_types.id"))
+    time_limit = Column(BigInteger)
+    order = Column(Integer)
+    type_id = Column(GUID, ForeignKey("task_types.id"), index=True)
 
     task_type = orm.relationship("TaskType")
     lesson = orm.relationship("Lesson")
     solves = orm.relationship("Solve",
                               back_populates="task",
-                              cascade="all, delete",
-                              lazy="subquery")
+                              cascade="all, delete")
 
     def __init__(self, name: str,
                  task_condition: str,
@@ -264,26 +228,15 @@ class Task(Base):
         self.time_limit = time_limit
         self.order = order
 
-    def to_json(self) -> dict:
-        return {
-            "id": self.id,
-            "name": self.name,
-            "task_condition": self.task_condition,
-            "time_limit": self.time_limit,
-            "tests": self.tests["tests"][:2],
-            "order": self.order
-        }
-
 
 class Role(Base):
     __tablename__ = "roles"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    title = Column(TEXT, nullable=False)
-    permissions = Column(TEXT, nullable=False)  # Формат и виды прописаны в Readme
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    title = Column(Text, nullable=False, index=True)
+    permissions = Column(Text, nullable=False)  # Формат и виды прописаны в Readme
 
-    users = orm.relationship("User", back_populates="role",
-                             lazy="subquery")
+    users = orm.relationship("User", back_populates="role")
 
     def __init__(self, title: str, permissions: str):
         """
@@ -293,33 +246,24 @@ class Role(Base):
         self.title = title
         self.permissions = permissions
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "permissions": self.permissions
-        }
-
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    name = Column(TEXT, nullable=False)
-    login = Column(TEXT, nullable=False, unique=True)
-    email = Column(TEXT, nullable=False)
-    password = Column(TEXT, nullable=False)
-    role_id = Column(UUID(as_uuid=True), ForeignKey("roles.id"))
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    name = Column(Text, nullable=False)
+    login = Column(Text, nullable=False, unique=True)
+    email = Column(Text, nullable=False, index=True)
+    password = Column(Text, nullable=False)
+    role_id = Column(GUID, ForeignKey("roles.id"), index=True)
 
     role = orm.relationship("Role")
     courses = orm.relationship("Course", secondary="users_to_courses",
-                               backref="courses",
-                               lazy="subquery")
+                               back_populates="users")
     solves = orm.relationship("Solve",
                               back_populates="user",
                               cascade="all, delete")
-    authors_courses = orm.relationship("Course", back_populates="author",
-                                       lazy="subquery")
+    authors_courses = orm.relationship("Course", back_populates="author")
 
     def __init__(self, name: str, login: str, email: str, role_id: uuid.UUID):
         """
@@ -333,10 +277,15 @@ class User(Base):
         self.email = email
         self.role_id = role_id
 
-    def generate_hash_password(self, password: str):
-        self.password = generate_password_hash(password)
+    def generate_hash_password(self, password: str, hasher=None):
+        """
+        :param hasher: PasswordHasher (None - посчитать в этом потоке с параметрами по умолчанию)
+        """
+        self.password = hasher.hash(password) if hasher else generate_password_hash(password)
 
-    def check_password(self, password: str):
+    def check_password(self, password: str, hasher=None):
+        if hasher:
+            return hasher.verify(self.password, password)
         return check_password_hash(self.password, password)
 
     def check_perm(self, *permissions) -> bool:
@@ -346,8 +295,7 @@ class User(Base):
         :type permissions: Tuple[str]
         :return: True, если у пользователя есть переданные полномочия
         """
-        return all([i in self.role.permissions or f"/{i[1:].capitalize()}" in self.role.permissions
-                    for i in permissions])
+        return has(parse(self.role.permissions), *permissions)
 
     def check_course(self, course: Course) -> bool:
         """
@@ -359,27 +307,16 @@ class User(Base):
                 return True
         return False
 
-    def to_json(self) -> dict:
-        return {
-            "id": self.id,
-            "name": self.name,
-            "login": self.login,
-            "email": self.email,
-            "role": self.role.to_json(),
-            "courses": [course.to_json() for course in self.courses]
-        }
-
-    def get_solves(self) -> dict:
-        return {"solves": [solve.to_json() for solve in self.solves]}
-
 
 class Attendance(Base):
     __tablename__ = "users_to_courses"
+    # Уникальный индекс, а не UniqueConstraint: его можно досоздать в существующей базе
+    __table_args__ = (Index("uq_users_to_courses_user_course", "user_id", "course_id", unique=True),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id"))
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
-    date = Column(DATE, default=datetime.datetime.now)
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    course_id = Column(GUID, ForeignKey("courses.id"), index=True)
+    user_id = Column(GUID, ForeignKey("users.id"))
+    date = Column(Date, default=datetime.datetime.now)
 
     def __init__(self, course_id: uuid.UUID, user_id: uuid.UUID):
         """
@@ -392,17 +329,28 @@ class Attendance(Base):
 
 class Solve(Base):
     __tablename__ = "solves"
-
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
-    verdict = Column(TEXT)
-    code = Column(TEXT)
-    time = Column(BIGINT)
-    date = Column(DATE, default=datetime.datetime.now)
+    __table_args__ = (Index("ix_solves_task_user_verdict", "task_id", "user_id", "verdict"),
+                      Index("ix_solves_task_user_created", "task_id", "user_id", "created_at", "id"),
+                      Index("ix_solves_verdict_created", "verdict", "created_at"))
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    task_id = Column(GUID, ForeignKey("tasks.id"))
+    user_id = Column(GUID, ForeignKey("users.id"), index=True)
+    verdict = Column(Text)
+    code = Column(Text)
+    time = Column(BigInteger)  # Максимальное процессорное время по тестам (в сотых долях секунды)
+    memory = Column(BigInteger)  # Пиковое потребление памяти по тестам (в КБ)
+    date = Column(Date, default=datetime.datetime.now)
+    # Время отправки: по нему упорядочиваются решения (date одинаковая у всех решений за день).
+    # У решений, отправленных до появления колонки, заполняется из date
+    created_at = Column(DateTime, default=datetime.datetime.now, info={"fill_from": "date"})
 
     task = orm.relationship("Task")
     user = orm.relationship("User")
+    tests = orm.relationship("TestResult",
+                             back_populates="solve",
+                             cascade="all, delete",
+                             order_by="TestResult.number")
 
     def __init__(self, task_id: uuid.UUID,
                  user_id: uuid.UUID,
@@ -422,12 +370,35 @@ class Solve(Base):
         self.verdict = verdict
         self.time = time
 
-    def to_json(self) -> dict:
-        return {
-            "id": self.id,
-            "task": self.task.to_json(),
-            "verdict": self.verdict,
-            "code": self.code,
-            "time": self.time,
-            "date": self.date
-        }
+
+class TestResult(Base):
+    __tablename__ = "test_results"
+    __table_args__ = (Index("ix_test_results_solve_number", "solve_id", "number"),)
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    solve_id = Column(GUID, ForeignKey("solves.id"))
+    number = Column(Integer, nullable=False)
+    status = Column(Text, nullable=False)  # OK, WA, TL, OL или RE
+    cpu_time = Column(Integer)  # user + sys (в мс)
+    wall_time = Column(Integer)  # астрономическое время (в мс)
+    memory = Column(BigInteger)  # пиковый RSS (в КБ)
+
+    solve = orm.relationship("Solve", back_populates="tests")
+
+    def __init__(self, number: int,
+                 status: str,
+                 cpu_time: int,
+                 wall_time: int,
+                 memory: int = None):
+        """
+        :param number: номер теста (начиная с 1)
+        :param status: результат теста: OK, WA, TL, OL или RE
+        :param cpu_time: процессорное время в мс
+        :param wall_time: астрономическое время в мс
+        :param memory: пиковое потребление памяти в КБ
+        """
+        self.number = number
+        self.status = status
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.memory = memory
@@ -1,26 +1,233 @@
+import threading
+import time
+import uuid
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool, StaticPool
 import sqlalchemy.ext.declarative as dec
+from sqlalchemy.schema import CreateColumn
 
 Base = dec.declarative_base()
 __factory = None
+__engine = None
+_counter = threading.local()  # счётчик SQL-запросов текущего потока
 
+# Настройки SQLite: WAL позволяет читать во время записи, synchronous=NORMAL
+# в режиме WAL не теряет целостность при сбое, а кэш и mmap уменьшают чтения с диска
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,  # в КБ (64 МБ)
+    "mmap_size": 256 * 1024 * 1024,
+}
 
-def global_init(db_password, db_username, db_address, db_name):
-    global __factory
+
+class GUID(sa.types.TypeDecorator):
+    """
+    UUID, который работает и в PostgreSQL (тип uuid), и в SQLite (CHAR(32)).
+    Принимает строки, поэтому ID из адреса запроса можно передавать без преобразования
+    """
+    impl = sa.Uuid
+    cache_ok = True
+
+    @property
+    def python_type(self):
+        # TypeDecorator сам тип не сообщает, а по нему восстанавливаются значения курсоров
+        return uuid.UUID
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return uuid.UUID(value)
+        return value
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, который считает, сколько времени потоки ждут соединение"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time = 0.0  # суммарное время получения соединений в секундах
+        self.max_wait = 0.0
+        self.timeouts = 0  # сколько раз соединения не дождались (pool_timeout)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa.exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def to_json(self) -> dict:
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total": round(self.wait_time, 6),
+                "wait_time_max": round(self.max_wait, 6),
+                "wait_time_avg": round(self.wait_time / self.checkouts, 6) if self.checkouts else 0
+            }
+
+
+def global_init(db_password, db_username, db_address, db_name,
+                pool_size: int = 10,
+                max_overflow: int = 20,
+                pool_timeout: float = 30,
+                pool_recycle: int = 1800,
+                pool_pre_ping: bool = True,
+                url: str = None):
+    """
+    :param pool_size: сколько соединений держать открытыми
+    :param max_overflow: сколько соединений можно открыть сверх pool_size при нагрузке
+    :param pool_timeout: сколько секунд ждать свободное соединение
+    :param pool_recycle: через сколько секунд переоткрывать соединение
+    :param pool_pre_ping: проверять соединение перед выдачей из пула
+    :param url: адрес базы (например, sqlite:///pytry.sqlite), вместо параметров PostgreSQL
+    """
+    global __factory, __engine
     if __factory:
         return
 
-    conn_str = f'postgresql://{db_username}:{db_password}@' \
-               f'{db_address}/{db_name}'
+    conn_str = url or f'postgresql://{db_username}:{db_password}@' \
+                      f'{db_address}/{db_name}'
     print(f"Подключение к базе данных по адресу {conn_str}")
-    engine = sa.create_engine(conn_str, echo=False, pool_size=0, max_overflow=25)
+    if sa.engine.make_url(conn_str).get_backend_name() == "sqlite":
+        engine = create_sqlite_engine(conn_str, pool_size, max_overflow, pool_timeout)
+    else:
+        engine = sa.create_engine(conn_str, echo=False,
+                                  poolclass=TimedQueuePool,
+                                  pool_size=pool_size,
+                                  max_overflow=max_overflow,
+                                  pool_timeout=pool_timeout,
+                                  pool_recycle=pool_recycle,
+                                  pool_pre_ping=pool_pre_ping)
+    __engine = engine
     __factory = orm.sessionmaker(bind=engine)
     from . import __all_models
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+
+
+def create_sqlite_engine(url: str,
+                         pool_size: int = 10,
+                         max_overflow: int = 20,
+                         pool_timeout: float = 30) -> sa.Engine:
+    """
+    Движок SQLite с настройками SQLITE_PRAGMAS.
+    Пока одно соединение пишет, остальные ждут блокировку до pool_timeout секунд (busy_timeout)
+    """
+    if sa.engine.make_url(url).database in (None, "", ":memory:"):
+        # База в памяти существует, пока открыто соединение, поэтому оно одно на всех
+        engine = sa.create_engine(url, echo=False, poolclass=StaticPool,
+                                  connect_args={"check_same_thread": False})
+    else:
+        engine = sa.create_engine(url, echo=False,
+                                  poolclass=TimedQueuePool,
+                                  pool_size=pool_size,
+                                  max_overflow=max_overflow,
+                                  pool_timeout=pool_timeout,
+                                  connect_args={"check_same_thread": False,
+                                                "timeout": pool_timeout})
+
+    @sa.event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return engine
+
+
+def add_missing_columns(engine):
+    """
+    create_all не меняет уже существующие таблицы,
+    поэтому новые колонки моделей добавляем сами.
+    Колонка с info={"fill_from": "<колонка>"} заполняется значениями другой колонки
+    """
+    inspector = sa.inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                source = column.info.get("fill_from")
+                if source:
+                    conn.execute(sa.update(table).values({column.name: table.c[source]}))
+
+
+def add_missing_indexes(engine):
+    """
+    Индексы, объявленные в моделях уже после создания таблиц.
+    Если уникальный индекс не создаётся из-за повторяющихся строк, сервер всё равно запускается
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except sa.exc.IntegrityError as e:
+                print(f"Не удалось создать индекс {index.name}: {e.orig}")
 
 
 def create_session() -> Session:
     global __factory
     return __factory()
+
+
+def get_engine() -> sa.Engine:
+    global __engine
+    return __engine
+
+
+def pool_stats() -> dict:
+    """Состояние пула соединений"""
+    global __engine
+    if __engine is None:
+        return {}
+    pool = __engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return pool.to_json()
+    return {"status": pool.status()}
+
+
+@sa.event.listens_for(sa.engine.Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_counter, "queries", None) is not None:
+        _counter.queries += 1
+
+
+def start_query_count():
+    """Начинает считать SQL-запросы, выполненные в текущем потоке"""
+    _counter.queries = 0
+
+
+def stop_query_count() -> int:
+    """
+    Заканчивает подсчёт
+    :return: сколько запросов выполнено после start_query_count
+    """
+    queries = getattr(_counter, "queries", None) or 0
+    _counter.queries = None
+    return queries
@@ -0,0 +1,15 @@
+"""
+Опции загрузки связей для запросов.
+
+Все связи моделей загружаются лениво. То, что попадёт в ответ,
+загружают опции из serializers.View, а здесь собраны опции
+для проверок доступа и запуска решений.
+"""
+from sqlalchemy.orm import joinedload
+
+from .__all_models import Course, Lesson, Task
+
+
+def task_with_course() -> list:
+    """Задание вместе с уроком, курсом и языком курса (для проверки доступа и запуска)"""
+    return [joinedload(Task.lesson).joinedload(Lesson.course).joinedload(Course.language)]
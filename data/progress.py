@@ -0,0 +1,45 @@
+"""
+Прогресс пользователя по заданиям
+"""
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from .__all_models import Solve
+
+SOLVED = "solved"  # есть решение с вердиктом OK
+ATTEMPTED = "attempted"  # решения есть, но ни одно не прошло
+UNTOUCHED = "untouched"  # решений нет
+
+
+def statuses_query(user_id: uuid.UUID, task_ids: list) -> sa.Select:
+    """(ID задания, 1 если решено) для заданий, у которых есть решения"""
+    solved = sa.func.max(sa.case((Solve.verdict == "OK", 1), else_=0))
+    return sa.select(Solve.task_id, solved).where(
+        Solve.user_id == user_id, Solve.task_id.in_(task_ids)
+    ).group_by(Solve.task_id)
+
+
+def task_statuses(sess: Session, user_id: uuid.UUID, task_ids) -> dict:
+    """
+    Статусы заданий одним запросом с группировкой (код решений не читается)
+    :param user_id: ID пользователя
+    :param task_ids: ID заданий
+    :return: ID задания -> SOLVED, ATTEMPTED или UNTOUCHED
+    """
+    task_ids = list(task_ids)
+    statuses = dict.fromkeys(task_ids, UNTOUCHED)
+    if not task_ids:
+        return statuses
+
+    for task_id, is_solved in sess.execute(statuses_query(user_id, task_ids)):
+        statuses[task_id] = SOLVED if is_solved else ATTEMPTED
+    return statuses
+
+
+def status_fields(status: str) -> dict:
+    """Поля ответа со статусом задания (is_solved и not_solved оставлены для старых клиентов)"""
+    if status == UNTOUCHED:
+        return {"status": status, "not_solved": True}
+    return {"status": status, "is_solved": status == SOLVED}
@@ -0,0 +1,196 @@
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+from subprocess import Popen, TimeoutExpired
+from threading import Thread, Lock, Event
+
+logger = logging.getLogger(__name__)
+
+ZYGOTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")
+SPAWN_TIMEOUT = 5  # Сколько ждать ответа зиготы на запуск решения (в секундах)
+
+
+class ZygoteProcess:
+    """
+    Решение, запущенное зиготой.
+    Повторяет ту часть интерфейса Popen, которая нужна TaskChecker
+    """
+
+    def __init__(self, args: list):
+        self.args = args
+        self.pid = None
+        self.returncode = None
+        self.cpu_time = None
+        self.memory = None
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self._started = Event()
+        self._finished = Event()
+
+    def wait(self, timeout=None) -> int:
+        if not self._finished.wait(timeout):
+            raise TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def wait4(self, timeout=None):
+        """
+        :return: (код возврата, процессорное время в секундах, пиковый RSS в КБ)
+        """
+        self.wait(timeout)
+        return self.returncode, self.cpu_time, self.memory
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.pid is None or self._finished.is_set():
+            return
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _finish(self, returncode: int):
+        self.returncode = returncode
+        self._finished.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for stream in (self.stdin, self.stdout, self.stderr):
+            if stream is not None:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+        if exc_type is not None:
+            self.kill()
+        self.wait()
+
+
+class ForkServer:
+    def __init__(self, python_path: str):
+        """
+        Запускает зиготу
+        :param python_path: путь до интерпретатора Python
+        """
+        self.python_path = python_path
+        self._sock, child_sock = socket.socketpair(socket.AF_UNIX,
+                                                   socket.SOCK_SEQPACKET)
+        self._process = Popen([python_path, ZYGOTE_PATH, str(child_sock.fileno())],
+                              pass_fds=(child_sock.fileno(),))
+        child_sock.close()
+
+        self._requests = {}  # id запроса -> ZygoteProcess
+        self._counter = itertools.count()
+        self._lock = Lock()
+        self._reader = Thread(target=self._read, daemon=True,
+                              name=f"forkserver-{self._process.pid}")
+        self._reader.start()
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None and self._reader.is_alive()
+
+    def spawn(self, path: str, cpu_limit: float = None) -> ZygoteProcess:
+        """
+        Запускает решение в дочернем процессе зиготы
+        :param path: путь до файла с решением
+        :param cpu_limit: лимит процессорного времени в секундах
+        :return: процесс с открытыми stdin, stdout и stderr
+        """
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+
+        process = ZygoteProcess([self.python_path, path])
+        process.stdin = open(stdin_w, "wb")
+        process.stdout = open(stdout_r, "rb")
+        process.stderr = open(stderr_r, "rb")
+
+        try:
+            with self._lock:
+                request_id = next(self._counter)
+                self._requests[request_id] = process
+                message = json.dumps({"id": request_id, "path": path,
+                                      "cpu_limit": cpu_limit}).encode("utf8")
+                socket.send_fds(self._sock, [message], [stdin_r, stdout_w, stderr_w])
+        finally:
+            for fd in (stdin_r, stdout_w, stderr_w):
+                os.close(fd)
+
+        if not process._started.wait(SPAWN_TIMEOUT) or process.pid is None:
+            with self._lock:
+                self._requests.pop(request_id, None)
+            process._finish(-signal.SIGKILL)
+            process.__exit__(None, None, None)
+            raise OSError("Fork server didn't start the solution")
+        return process
+
+    def close(self):
+        self._sock.close()
+        try:
+            self._process.wait(SPAWN_TIMEOUT)
+        except TimeoutExpired:
+            self._process.kill()
+
+    def _read(self):
+        while True:
+            try:
+                message = self._sock.recv(4096)
+            except OSError:
+                message = b""
+            if not message:
+                break
+
+            data = json.loads(message)
+            with self._lock:
+                process = self._requests.get(data["id"])
+                if "status" in data:
+                    self._requests.pop(data["id"], None)
+            if process is None:
+                continue
+
+            if "pid" in data:
+                process.pid = data["pid"]
+                process._started.set()
+            if "status" in data:
+                process.cpu_time = data.get("cpu_time")
+                process.memory = data.get("memory")
+                process._finish(data["status"])
+
+        # Зигота умерла: будим всех, кто ждёт свои решения
+        logger.error("Fork server for %s has stopped", self.python_path)
+        with self._lock:
+            requests, self._requests = self._requests, {}
+        for process in requests.values():
+            process._started.set()
+            process._finish(-signal.SIGKILL)
+
+
+_servers = {}
+_servers_lock = Lock()
+
+
+def get_fork_server(python_path: str) -> ForkServer:
+    """
+    :param python_path: путь до интерпретатора Python
+    :return: работающая зигота для этого интерпретатора
+    """
+    with _servers_lock:
+        server = _servers.get(python_path)
+        if server is None or not server.is_alive():
+            if server is not None:
+                server.close()
+            server = ForkServer(python_path)
+            _servers[python_path] = server
+        return server
+
+
+def is_supported() -> bool:
+    return sys.platform != "win32" and hasattr(socket, "send_fds")
@@ -0,0 +1,57 @@
+"""
+Настройки gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+
+Приложение загружается один раз в главном процессе (preload_app), затем процессы
+создаются через fork. Соединения с базой, открытые до fork, в процессах
+не используются, а потоки проверки и записи вердиктов запускаются в каждом процессе.
+По SIGTERM процесс сразу перестаёт принимать решения и начинает дожидаться проверки
+своей очереди, пока gunicorn дообрабатывает открытые запросы (main.begin_shutdown).
+"""
+import signal
+
+from config import web_bind, web_workers, web_threads, shutdown_timeout
+
+bind = web_bind
+workers = web_workers
+worker_class = "gthread"
+threads = web_threads
+preload_app = True
+# Сколько секунд дать обычным запросам на завершение (потоки событий закрываются сразу)
+request_drain_timeout = 10
+# Через graceful_timeout после SIGTERM gunicorn убивает процесс, поэтому время остановки -
+# запросы, проверка очереди и запись вердиктов (каждое ждёт до SHUTDOWN_TIMEOUT)
+graceful_timeout = request_drain_timeout + 2 * int(shutdown_timeout) + 5
+
+
+def post_fork(server, worker):
+    from data.database import get_engine
+    from main import start_background
+
+    # Соединения пула главного процесса нельзя делить между процессами
+    engine = get_engine()
+    if engine is not None:
+        engine.dispose(close=False)
+    start_background()
+
+
+def post_worker_init(worker):
+    from main import begin_shutdown
+
+    # gunicorn вызывает worker_exit, только когда дождётся открытых запросов,
+    # поэтому проверку очереди начинаем по самому сигналу
+    handle_exit = signal.getsignal(signal.SIGTERM)
+    draining = []
+
+    def handle_term(sig, frame):
+        handle_exit(sig, frame)
+        if not draining:
+            draining.append(True)
+            begin_shutdown(shutdown_timeout)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    from main import shutdown
+
+    shutdown(shutdown_timeout)
@@ -0,0 +1,147 @@
+import logging
+import queue
+import uuid
+from collections import OrderedDict
+from threading import Thread, Lock
+from time import monotonic
+
+from data.database import create_session
+from verdict_writer import fail_solves
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """Очередь проверки переполнена"""
+
+
+class JudgePool:
+    def __init__(self, workers: int, max_queue: int, events=None):
+        """
+        :param workers: количество потоков, одновременно проверяющих решения
+        :param max_queue: максимальное количество решений в очереди
+        :param events: SolveEvents, куда сообщать о сбоях проверки
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.events = events
+
+        # Длину очереди ограничивает submit, чтобы stop всегда мог добавить _STOP
+        self._queue = queue.Queue()
+        # Решения, ожидающие проверки, в порядке поступления (ID -> TaskChecker)
+        self._pending = OrderedDict()
+        # Решения, которые проверяются сейчас
+        self._running = set()
+        self._lock = Lock()
+        self._threads = []
+        self._stopped = False
+
+    def start(self):
+        """Запускает потоки проверки (повторный вызов ничего не делает)"""
+        with self._lock:
+            self._stopped = False
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = Thread(target=self._work, name=f"judge-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, checker) -> int:
+        """
+        Ставит решение в очередь на проверку
+        :param checker: объект TaskChecker
+        :return: позиция решения в очереди (начиная с 1)
+        :raises QueueFullError: если очередь заполнена
+        """
+        with self._lock:
+            if self._stopped or len(self._pending) >= self.max_queue:
+                raise QueueFullError()
+            self._queue.put_nowait(checker)
+            self._pending[checker.id] = checker
+            return len(self._pending)
+
+    def stop(self, timeout: float = None):
+        """
+        Перестаёт принимать решения и ждёт, пока проверятся уже поставленные в очередь.
+        Решения, которые за timeout секунд не успели проверить (в том числе проверяемые сейчас),
+        получают вердикт "Internal error": после остановки их вердикт некому записать
+        """
+        with self._lock:
+            self._stopped = True
+            threads, self._threads = self._threads, []
+        # _STOP встают в очередь после всех решений, поэтому потоки сначала проверят их
+        for _ in threads:
+            self._queue.put(_STOP)
+        deadline = None if timeout is None else monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - monotonic(), 0))
+
+        with self._lock:
+            # Потоки пропускают решения, которых уже нет в _pending, и доходят до _STOP
+            pending = list(self._pending.values())
+            self._pending.clear()
+            running = list(self._running)
+        for checker in pending:
+            checker.cleanup()
+        if pending or running:
+            logger.warning("%d queued and %d running solves were not checked before shutdown",
+                           len(pending), len(running))
+            fail_solves([checker.id for checker in pending] + running, self.events)
+
+    def position(self, solve_id: uuid.UUID):
+        """
+        :return: позиция решения в очереди или None, если решение уже проверяется
+        """
+        with self._lock:
+            for i, pending_id in enumerate(self._pending, 1):
+                if pending_id == solve_id:
+                    return i
+        return None
+
+    def owns(self, solve_id: uuid.UUID) -> bool:
+        """
+        :return: True, если решение ждёт проверки или проверяется в этом процессе
+        """
+        with self._lock:
+            return solve_id in self._pending or solve_id in self._running
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def to_json(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "depth": self.depth()
+        }
+
+    def _work(self):
+        while True:
+            checker = self._queue.get()
+            if checker is _STOP:
+                return
+            with self._lock:
+                if self._pending.pop(checker.id, None) is None:
+                    continue  # stop уже поставил решению "Internal error"
+                self._running.add(checker.id)
+
+            # У каждой проверки своя сессия: сессии нельзя делить между потоками
+            sess = create_session()
+            try:
+                checker(sess)
+            except Exception:
+                logger.exception("Checking of solve %s failed", checker.id)
+                sess.rollback()
+                self._fail(checker.id)
+            finally:
+                sess.close()
+                with self._lock:
+                    self._running.discard(checker.id)
+
+    def _fail(self, solve_id: uuid.UUID):
+        """Ставит решению вердикт "Internal error" и сообщает о нём подписчикам"""
+        fail_solves([solve_id], self.events)
@@ -1,15 +1,35 @@
 import json
 
-from flask import Flask, request, Response, jsonify, session
+from flask import (Flask, request, Response, jsonify, session, stream_with_context, g,
+                   send_from_directory)
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, get_jwt
 from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 jwt_required, get_jwt_identity,
                                 get_current_user, decode_token)
-from task_checking import TaskChecker
+from task_checking import TaskChecker, RUNNERS
+from judge_pool import JudgePool, QueueFullError
+from artifact_cache import ArtifactCache
+from verdict_cache import VerdictCache, make_key
+from verdict_writer import VerdictWriter
+from catalog_cache import CatalogCache
+from user_cache import UserCache, CachedUser, RoleCache
+from permissions import make_claims
+from passwords import PasswordHasher
+from solve_events import SolveEvents, format_sse
+from serializers import View, FieldError, FastJSONProvider
+from pagination import Page, PageError
+from pictures import PictureStore, PictureError, MAX_AGE as PICTURE_MAX_AGE
 from data.__all_models import *
-from time import sleep
+from data.loaders import task_with_course
+from data.progress import task_statuses, status_fields, SOLVED
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from time import sleep, monotonic
+from queue import Empty
 from uuid import UUID
+from threading import Thread, Lock
 
 import logging
 
@@ -20,31 +40,126 @@ logging.basicConfig(filename="runtime.log",
                     format='%(asctime)s %(levelname)s %(name)s %(message)s',
                     level=logging.DEBUG)
 
+Flask.json_provider_class = FastJSONProvider
 app = Flask(__name__)
 app.config["CORS_SUPPORTS_CREDENTIALS"] = True
 CORS(app, supports_credentials=True)
 app.config["JWT_SECRET_KEY"] = "SECRET_KEY"
 app.config["SECRET_KEY"] = "LONG_LONG_KEY"
 jwt_manager = JWTManager(app)
+query_log = logging.getLogger("queries")
+solve_events = SolveEvents(solve_events_streams)
+judge_pool = JudgePool(judge_workers, judge_queue_size, solve_events)
+artifact_cache = ArtifactCache(judge_artifact_dir, judge_artifact_cache_size)
+verdict_cache = VerdictCache(verdict_cache_size)
+verdict_writer = VerdictWriter(verdict_batch_size, verdict_batch_interval, verdict_cache, solve_events)
+catalog_cache = CatalogCache(catalog_cache_size, catalog_cache_ttl)
+user_cache = UserCache(user_cache_size, user_cache_ttl)
+role_cache = RoleCache(user_cache_size, role_cache_ttl)
+password_hasher = PasswordHasher(password_method, password_salt_length, password_workers)
+picture_store = PictureStore(picture_dir, picture_sizes, picture_quality)
+shutdown_thread = None  # поток остановки (begin_shutdown)
+shutdown_lock = Lock()
 
 
 @jwt_manager.user_lookup_loader
-def take_user(header_data, payload_data) -> User:
-    # print(header_data, payload_data)
-    # sess = create_session()
-    user = g_sess.get(User, payload_data["sub"])
-    return user
+def take_user(header_data, payload_data) -> CachedUser:
+    user = user_cache.load(payload_data["sub"])
+    # Полномочия берём из токена: check_perm не обращается к базе
+    return user.with_claims(payload_data) if user else None
+
+
+@jwt_manager.token_verification_loader
+def check_role_version(header_data, payload_data) -> bool:
+    # Токены без claims ролей (refresh и выданные раньше) проверять не по чему
+    if "rv" not in payload_data:
+        return True
+    # Пользователя могли перевести в другую роль: тогда claims токена относятся к старой
+    user = user_cache.load(payload_data["sub"])
+    if user is None or str(user.role_id) != payload_data["role"]:
+        return False
+    role = role_cache.load(payload_data["role"])
+    return role is not None and role[1] == payload_data["rv"]
+
+
+@jwt_manager.token_verification_failed_loader
+def role_changed(header_data, payload_data):
+    return {"status": "Role changed, refresh the token"}, 401
+
+
+def access_claims(user) -> dict:
+    """
+    :param user: User или CachedUser
+    """
+    permissions = user.permissions if isinstance(user, CachedUser) else user.role.permissions
+    return {"login": user.login, **make_claims(user.role_id, permissions)}
+
+
+def db_session() -> Session:
+    """Сессия текущего запроса: создаётся при первом обращении и закрывается в close_db_session"""
+    if "db_session" not in g:
+        g.db_session = create_session()
+    return g.db_session
+
+
+@app.teardown_appcontext
+def close_db_session(exception):
+    # close откатывает незавершённую транзакцию и возвращает соединение в пул
+    sess = g.pop("db_session", None)
+    if sess is not None:
+        sess.close()
+
+
+@app.before_request
+def start_counting_queries():
+    start_query_count()
+
+
+@app.after_request
+def report_query_count(response):
+    # Количество SQL-запросов на обработку запроса: видно в заголовке и в логе
+    queries = stop_query_count()
+    response.headers["X-Query-Count"] = str(queries)
+    query_log.debug("%s %s: %d queries", request.method, request.path, queries)
+    return response
+
+
+@app.errorhandler(FieldError)
+@app.errorhandler(PageError)
+def wrong_fields(error):
+    return {"status": str(error)}, 400
+
+
+def make_page(columns: tuple, descending: bool = False) -> Page:
+    return Page(request.args, columns, descending,
+                default_limit=page_size, max_limit=max_page_size)
+
+
+def attends_course(sess, user, course_id) -> bool:
+    """
+    Проверяет, что пользователь записан на курс.
+    Курсы берутся из кэша пользователя, а если курса там нет - из базы: пользователя могли
+    записать на курс в другом процессе, и сброс кэша в том процессе здесь не виден
+    :param user: CachedUser
+    """
+    if course_id in user.course_ids:
+        return True
+    if not sess.query(Attendance).filter(Attendance.user_id == user.id,
+                                         Attendance.course_id == course_id).first():
+        return False
+    user_cache.pop(user.id)
+    return True
 
 
 def check_task_request(course_id, lesson_id, task_id, user):
-    sess = create_session()
+    sess = db_session()
 
     # user = get_current_user()
     course = sess.get(Course, course_id)
     lesson = sess.get(Lesson, lesson_id)
     task = sess.get(Task, task_id)
 
-    if course not in user.courses and not user.check_perm("/c"):
+    if not user.check_perm("/c") and not attends_course(sess, user, course.id):
         return {"status": "User not at course"}, 403
 
     if lesson not in course.lessons:
@@ -63,6 +178,60 @@ def prepare_starting():
     if not user_role:
         sess.add(Role("user", "/Ca /Ua"))
         sess.commit()
+    sess.close()
+
+
+def create_app() -> Flask:
+    """
+    Подключается к базе и готовит её. Вызывается один раз: в gunicorn (preload_app) -
+    в главном процессе до fork, поэтому потоки здесь не запускаются (см. start_background)
+    """
+    global_init(db_password, db_username, db_address, db_name,
+                pool_size=db_pool_size,
+                max_overflow=db_max_overflow,
+                pool_timeout=db_pool_timeout,
+                pool_recycle=db_pool_recycle,
+                pool_pre_ping=db_pool_pre_ping,
+                url=db_url)
+    prepare_starting()
+    return app
+
+
+def start_background():
+    """Запускает потоки записи вердиктов и проверки решений (в каждом процессе сервера)"""
+    verdict_writer.start()
+    judge_pool.start()
+
+
+def begin_shutdown(timeout: float = None) -> Thread:
+    """
+    Начинает остановку в отдельном потоке (повторный вызов возвращает тот же поток):
+    закрывает потоки событий, перестаёт принимать решения и ждёт проверки очереди,
+    затем записи вердиктов. Вызывается сразу по сигналу остановки, пока сервер
+    ещё дообрабатывает запросы
+    :param timeout: сколько секунд ждать каждое из двух (всего - до 2 * timeout)
+    """
+    global shutdown_thread
+    with shutdown_lock:
+        if shutdown_thread is None:
+            shutdown_thread = Thread(target=drain, args=(timeout,), name="shutdown")
+            shutdown_thread.start()
+        return shutdown_thread
+
+
+def drain(timeout: float = None):
+    solve_events.close()
+    judge_pool.stop(timeout)
+    verdict_writer.stop(timeout)
+
+
+def shutdown(timeout: float = None):
+    """
+    Останавливает фоновые потоки и дожидается этого
+    :param timeout: сколько секунд ждать проверку очереди и, отдельно, запись вердиктов
+    """
+    begin_shutdown(timeout).join()
+    password_hasher.shutdown()
 
 
 @app.route("/reg", methods=["POST"])
@@ -74,7 +243,7 @@ def reg():
                 f"You have to send {', '.join(['login', 'password', 'name', 'email'])}"
         }, 400
 
-    sess = create_session()
+    sess = db_session()
 
     if sess.query(User).filter_by(login=json["login"]).first() or \
             sess.query(User).filter_by(email=json["email"]).first():
@@ -84,21 +253,20 @@ def reg():
                 login=json["login"],
                 email=json["email"],
                 role_id=sess.query(Role).filter(Role.title == "user").first().id)
-    user.generate_hash_password(json["password"])
+    user.generate_hash_password(json["password"], password_hasher)
 
     sess.add(user)
     sess.commit()
+    view = View("user", request.args, expand="role,courses.language")
 
     refresh_token = create_refresh_token(identity=user.id, additional_claims={"login": user.login})
 
     return {
         "status": "success",
         "jwt_access": create_access_token(identity=user.id,
-                                          additional_claims={
-                                              "login": user.login
-                                          }),
+                                          additional_claims=access_claims(user)),
         "jwt_refresh": refresh_token,
-        "user": user.to_json()
+        "user": view.dump(user)
     }, 200
 
 
@@ -111,50 +279,69 @@ def login():
             "status": "You have to send 'password' and 'email' or 'login'"
         }, 400
 
-    sess = create_session()
+    sess = db_session()
+    view = View("user", request.args, expand="role,courses.language")
 
-    user = sess.query(User).filter(
+    user = sess.query(User).options(*view.options()).filter(
         (
                 User.login == json.get("login", "")
         ) | (
                 User.email == json.get("email", "")
         )
     ).first()
-    if not user or not user.check_password(json["password"]):
+    if not user or not user.check_password(json["password"], password_hasher):
         return {"status": "incorrect"}, 404
 
     refresh_token = create_refresh_token(identity=user.id, additional_claims={"login": user.login})
 
-    return {
+    response = {
         "status": "success",
         "jwt_access": create_access_token(
             identity=user.id,
-            additional_claims={
-                "login": user.login
-            }
+            additional_claims=access_claims(user)
         ),
         "jwt_refresh": refresh_token,
-        "user": user.to_json()
-    }, 200
+        "user": view.dump(user)
+    }
+
+    # Пароль известен только при входе, поэтому здесь же переводим хэш на текущие параметры
+    if password_hasher.needs_rehash(user.password):
+        user.generate_hash_password(json["password"], password_hasher)
+        sess.commit()
+
+    return response, 200
 
 
 @app.route("/courses")
 @jwt_required(optional=True)
 def get_courses():
-    sess = create_session()
-    courses = sess.query(Course).all()
-    if get_jwt():
-        user = get_current_user()
-        if user.check_perm("/c"):
-            return {"courses": [course.to_json() for course in courses]}
-    return {"courses": [course.to_json()
-                        for course in courses if course.is_public]}
+    privileged = bool(get_jwt()) and get_current_user().check_perm("/c")
+    view = View("course", request.args, expand="language")
+    page = make_page((Course.name, Course.id))
+
+    key = catalog_cache.make_key(privileged, request.args)
+    cached = catalog_cache.get(key)
+    if cached is None:
+        sess = db_session()
+        query = sess.query(Course).options(*view.options())
+        if not privileged:
+            query = query.filter(Course.is_public.is_(True))
+        courses, next_cursor = page.split(page.apply(query).all())
+        body = jsonify({"courses": view.dump_all(courses), "next_cursor": next_cursor}).get_data()
+        cached = catalog_cache.store(key, body)
+
+    etag, body = cached
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = privileged or None
+    return response.make_conditional(request)
 
 
 @app.route("/courses/attend/<course_id>")
 @jwt_required()
 def attend(course_id):
-    sess = create_session()
+    sess = db_session()
     sess.expire_on_commit = False
 
     user = get_current_user()
@@ -166,35 +353,44 @@ def attend(course_id):
     if not course.is_public and not user.check_perm("/c"):
         return {"status": "Forbidden"}, 403
 
-    if user.check_course(course) or course.check_user(user):
+    # Проверяем одну запись, а не загружаем всех учеников курса
+    if sess.query(Attendance).filter(Attendance.user_id == user.id,
+                                     Attendance.course_id == course.id).first():
         return {"status": "Already on course"}
 
     sess.add(Attendance(course.id, user.id))
-    sess.commit()
+    try:
+        sess.commit()
+    except IntegrityError:
+        # Параллельный запрос уже записал пользователя (уникальный индекс users_to_courses)
+        sess.rollback()
+        return {"status": "Already on course"}
+    user_cache.pop(user.id)
     return {"status": "success"}
 
 
 @app.route("/courses/<course_id>")
 @jwt_required()
 def get_course(course_id):
-    sess = create_session()
+    sess = db_session()
     sess.expire_on_commit = False
 
     user = get_current_user()
-    course = sess.get(Course, course_id)
+    view = View("course", request.args, fields="*,language,lessons.*,lessons.tasks,lessons.links")
+    course = sess.get(Course, course_id, options=view.options())
 
     if not course:
         return {"status": "Course not found"}, 404
 
-    resp = course.to_json()
+    resp = view.dump(course)
     resp["at_course"] = True
 
-    attendance = sess.query(Attendance).filter(Attendance.user_id == user.id, Attendance.course_id == course.id).first()
+    attendance = attends_course(sess, user, course.id)
     if not attendance and user.check_perm("/c"):
         resp["at_course"] = False
     elif not attendance:
         resp["at_course"] = False
-        resp.pop("lessons")
+        resp.pop("lessons", None)
 
     return resp
 
@@ -202,26 +398,22 @@ def get_course(course_id):
 @app.route("/lessons/<lesson_id>")
 @jwt_required()
 def get_lesson(lesson_id):
-    sess = create_session()
+    sess = db_session()
     user = get_current_user()
-    lesson = sess.get(Lesson, lesson_id)
+    view = View("lesson", request.args, fields="*,tasks,links")
+    lesson = sess.get(Lesson, lesson_id, options=view.options())
 
     if not lesson:
         return {"status": "Not found"}, 404
 
-    if lesson.course not in user.courses and not user.check_perm("/c"):
+    if not user.check_perm("/c") and not attends_course(sess, user, lesson.course_id):
         return {"status": "User not at course"}, 403
 
-    data = lesson.to_json()
-    for task in data["tasks"]:
-        temp = sess.query(Solve).filter(Solve.task_id == task["id"],
-                                        Solve.user_id == user.id).all()
-        if not temp:
-            task["not_solved"] = True
-        elif any([i.verdict == "OK" for i in temp]):
-            task["is_solved"] = True
-        else:
-            task["is_solved"] = False
+    data = view.dump(lesson)
+    if view.wants("tasks"):
+        statuses = task_statuses(sess, user.id, [task.id for task in lesson.tasks])
+        for task_obj, task in zip(lesson.tasks, data["tasks"]):
+            task.update(status_fields(statuses[task_obj.id]))
 
     return data
 
@@ -231,23 +423,20 @@ def get_lesson(lesson_id):
 def get_task(task_id):
     user = get_current_user()
 
-    sess = create_session()
-    task = sess.get(Task, task_id)
+    view = View("task", request.args, fields="*")
+    sess = db_session()
+    task = sess.get(Task, task_id, options=task_with_course() + view.options())
 
     if not task:
         return {"status": "Task not found"}, 404
 
-    if task.lesson.course not in user.courses and not user.check_perm("/c"):
+    if not user.check_perm("/c") and not attends_course(sess, user, task.lesson.course_id):
         return {"status": "Forbidden"}, 403
 
-    ok_solve = sess.query(Solve).filter(Solve.task_id == task.id, Solve.user_id == user.id,
-                                        Solve.verdict == "OK").first()
-    task = task.to_json()
-
-    if ok_solve:
-        task["is_solved"] = True
-    else:
-        task["is_solved"] = False
+    status = task_statuses(sess, user.id, [task.id])[task.id]
+    task = view.dump(task)
+    task["status"] = status
+    task["is_solved"] = status == SOLVED
 
     return task
 
@@ -255,37 +444,38 @@ def get_task(task_id):
 @app.route("/user/courses/<user_id>")
 @jwt_required()
 def get_courses_of_user(user_id):
-    sess = create_session()
+    sess = db_session()
     user = get_current_user()
+    view = View("course", request.args, expand="language")
+    page = make_page((Course.name, Course.id))
     requested_user = sess.get(User, user_id)
 
     if not requested_user:
         return {"status": "Not found"}, 404
 
-    if user.id == requested_user.id:
-        return {"courses": [course.to_json() for course in user.courses]}
-
-    if user.check_perm("/u"):
-        return {
-            "courses": [course.to_json() for course in requested_user.courses]
-        }
+    if user.id != requested_user.id and not user.check_perm("/u"):
+        return {"status": "Forbidden"}, 403
 
-    return {"status": "Forbidden"}, 403
+    query = sess.query(Course).join(Attendance, Attendance.course_id == Course.id).filter(
+        Attendance.user_id == requested_user.id
+    ).options(*view.options())
+    courses, next_cursor = page.split(page.apply(query).all())
+    return {"courses": view.dump_all(courses), "next_cursor": next_cursor}
 
 
 @app.route("/tasks/<task_id>", methods=["POST"])
 @jwt_required()
 def post_task(task_id):
-    sess = create_session()
+    sess = db_session()
     sess.expire_on_commit = False
     user = get_current_user()
 
-    task = sess.get(Task, task_id)
+    task = sess.get(Task, task_id, options=task_with_course())
 
     if not task:
         return {"status": "Task is not found"}, 404
 
-    if task.lesson.course not in user.courses and not user.check_perm("/c"):
+    if not user.check_perm("/c") and not attends_course(sess, user, task.lesson.course_id):
         return {"status": "Forbidden"}, 403
 
     json = request.json
@@ -293,21 +483,50 @@ def post_task(task_id):
     if "code" not in json:
         return {"status": "You have to send 'code'"}, 400
 
+    language = task.lesson.course.language
+    cache_key = make_key(json["code"], task, language)
+
+    # Такой же код уже проверялся на тех же тестах - отвечаем сразу
+    cached = verdict_cache.get(cache_key)
+    if cached is not None:
+        verdict, time, memory, tests = cached
+        solve = Solve(task.id, user.id, json["code"], time, verdict)
+        solve.memory = memory
+        solve.tests = [TestResult(*test) for test in tests]
+        sess.add(solve)
+        sess.commit()
+        return {"status": "checked", "solve_id": solve.id}
+
+    if judge_pool.depth() >= judge_pool.max_queue:
+        return {"status": "Queue is full, try again later"}, 503
+
     solve = Solve(task.id, user.id, json["code"])
     sess.add(solve)
     sess.commit()
 
-    language = task.lesson.course.language
-
     checker = TaskChecker(json["code"], task.time_limit,
                           language.path,
-                          task.tests, language.options, solve.id)
-    thread = checker.run(sess)
-
-    # while thread.is_alive():
-    #     sleep(0.5)
+                          task.tests, language.options, solve.id,
+                          output_limit=judge_output_limit,
+                          test_workers=judge_test_workers,
+                          runner=language.runner,
+                          extension=language.extension,
+                          artifact_cache=artifact_cache,
+                          compile_timeout=judge_compile_timeout,
+                          verdict_cache=verdict_cache,
+                          cache_key=cache_key,
+                          events=solve_events,
+                          wall_factor=judge_wall_factor,
+                          writer=verdict_writer)
+    try:
+        position = judge_pool.submit(checker)
+    except QueueFullError:
+        checker.cleanup()
+        sess.delete(solve)
+        sess.commit()
+        return {"status": "Queue is full, try again later"}, 503
 
-    return {"status": "checking", "solve_id": solve.id}
+    return {"status": "checking", "solve_id": solve.id, "queue_position": position}
 
 
 @app.route("/solves/<solve_id>")
@@ -315,43 +534,182 @@ def post_task(task_id):
 def check_solve_status(solve_id):
     user = get_current_user()
 
-    sess = create_session()
+    view = View("solve", request.args, fields="*,task.*,tests")
+    sess = db_session()
 
-    solve = sess.get(Solve, solve_id)
+    solve = sess.get(Solve, solve_id, options=view.options())
 
     if not solve:
         return {"status": "Solve not found"}, 404
 
-    if solve.user.id != user.id and not user.check_perm("/C"):
+    if solve.user_id != user.id and not user.check_perm("/C"):
         return {"status": "Forbidden"}, 403
 
     if solve.verdict == "Check":
-        return {"status": "Checking", "is_checked": False}
+        return {"status": "Checking", "is_checked": False,
+                "queue_position": queue_position(sess, solve)}
 
-    info = solve.to_json()
+    info = view.dump(solve)
     info["is_checked"] = True
 
     return info
 
 
+def queue_position(sess, solve: Solve):
+    """
+    Место решения в очереди. Очередь у каждого процесса сервера своя, поэтому для решения
+    из другого процесса место оценивается по базе: сколько решений отправлено раньше
+    и ещё не проверено (во всех процессах), плюс один
+    :return: место или None, если решение уже проверяется в этом процессе
+    """
+    if judge_pool.owns(solve.id):
+        return judge_pool.position(solve.id)
+    ahead = sess.query(func.count(Solve.id)).filter(Solve.verdict == "Check",
+                                                   Solve.created_at < solve.created_at).scalar()
+    return ahead + 1
+
+
+def read_verdict(solve_id: UUID):
+    """
+    :return: событие verdict из базы или None, если решение ещё проверяется
+    """
+    sess = create_session()
+    try:
+        row = sess.query(Solve.verdict, Solve.time).filter(Solve.id == solve_id).one_or_none()
+    finally:
+        sess.close()
+    if row is None or row.verdict == "Check":
+        return None
+    return {"type": "verdict", "verdict": row.verdict, "time": row.time}
+
+
+@app.route("/solves/<solve_id>/events")
+@jwt_required()
+def stream_solve_status(solve_id):
+    """
+    Server-Sent Events с прогрессом проверки решения.
+    Поток закрывается после события verdict или через SOLVE_EVENTS_TIMEOUT секунд,
+    после чего клиент подключается заново
+    """
+    user = get_current_user()
+
+    sess = db_session()
+
+    solve = sess.get(Solve, solve_id)
+
+    if not solve:
+        return {"status": "Solve not found"}, 404
+
+    if solve.user_id != user.id and not user.check_perm("/C"):
+        return {"status": "Forbidden"}, 403
+
+    solve_id = solve.id
+    verdict, time = solve.verdict, solve.time
+    position = queue_position(sess, solve) if verdict == "Check" else None
+    sess.close()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    retry = solve_events_retry * 1000
+
+    if verdict != "Check":
+        event = {"type": "verdict", "verdict": verdict, "time": time}
+        return Response(format_sse(event), mimetype="text/event-stream", headers=headers)
+
+    def stream():
+        # Место занимается внутри генератора: его finally выполняется, только если генератор запущен
+        if not solve_events.open_stream():
+            # Все места заняты: отдаём место в очереди, а клиент подключится через retry
+            yield format_sse({"type": "queue", "queue_position": position}, retry)
+            return
+        events = solve_events.subscribe(solve_id)
+        try:
+            yield format_sse({"type": "queue", "queue_position": position}, retry)
+            deadline = monotonic() + solve_events_timeout
+            last_sent = monotonic()
+            wait = 0  # вердикт мог записаться до подписки, поэтому база проверяется сразу
+            while monotonic() < deadline:
+                try:
+                    event = events.get(timeout=wait)
+                except Empty:
+                    # Решение могло проверяться в другом процессе, его вердикт есть только в базе
+                    event = read_verdict(solve_id)
+                wait = min(solve_events_poll, max(deadline - monotonic(), 0))
+                if event is None:
+                    if monotonic() - last_sent >= solve_events_keepalive:
+                        last_sent = monotonic()
+                        yield ": keepalive\n\n"
+                    continue
+                if event["type"] == "close":
+                    return  # сервер останавливается, клиент подключится заново через retry
+                last_sent = monotonic()
+                yield format_sse(event)
+                if event["type"] == "verdict":
+                    return
+        finally:
+            solve_events.unsubscribe(solve_id, events)
+            solve_events.close_stream()
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers=headers)
+
+
+@app.route("/judge/queue")
+@jwt_required()
+def get_judge_queue():
+    if not get_current_user().check_perm("/Ca"):
+        return {"status": "Forbidden"}, 403
+
+    info = judge_pool.to_json()
+    info["artifact_cache"] = artifact_cache.to_json()
+    info["verdict_cache"] = verdict_cache.to_json()
+    info["verdict_writer"] = verdict_writer.to_json()
+    info["catalog_cache"] = catalog_cache.to_json()
+    info["event_streams"] = {"open": solve_events.streams, "max": solve_events.max_streams}
+    return info
+
+
+@app.route("/pictures/<name>")
+def get_picture(name):
+    # Имя файла - хэш содержимого, поэтому картинку можно кэшировать навсегда
+    response = send_from_directory(picture_store.directory, name, max_age=PICTURE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/db/pool")
+@jwt_required()
+def get_pool_stats():
+    if not get_current_user().check_perm("/Ca"):
+        return {"status": "Forbidden"}, 403
+
+    return pool_stats()
+
+
 @app.route("/tasks/<task_id>/solves")
 @jwt_required()
 def get_task_solves(task_id):
     user = get_current_user()
 
-    sess = create_session()
+    view = View("solve", request.args)
+    # Сначала новые решения (решения, отправленные в одно время, - по id)
+    page = make_page((Solve.created_at, Solve.id), descending=True)
+    sess = db_session()
     task = sess.get(Task, task_id)
 
     if not task:
         return {"status": "Not found"}, 404
 
-    return {"solves": [solve.to_json() for solve in task.solves if solve.user_id == user.id]}
+    # Решения других пользователей не загружаем
+    query = sess.query(Solve).options(*view.options()).filter(Solve.task_id == task.id,
+                                                              Solve.user_id == user.id)
+    solves, next_cursor = page.split(page.apply(query).all())
+    return {"solves": view.dump_all(solves), "next_cursor": next_cursor}
 
 
 @app.route("/users/<user_id>/password", methods=["UPDATE"])
 @jwt_required()
 def update_password(user_id):
-    sess = create_session()
+    sess = db_session()
     user = get_current_user()
     user_ = sess.get(User, user_id)
 
@@ -363,20 +721,22 @@ def update_password(user_id):
     if "new_password" not in json:
         return {"status": "You have to send 'new_password'"}, 400
 
-    if user.check_perm("/U") and user != user_:
-        user_.generate_hash_password(json["new_password"])
+    if user.check_perm("/U") and user.id != user_.id:
+        user_.generate_hash_password(json["new_password"], password_hasher)
         sess.commit()
+        user_cache.pop(user_.id)
         return {"status": "OK"}
 
-    if user == user_:
+    if user.id == user_.id:
         if "old_password" not in json:
             return {"status": "You have to send 'old_password'"}
 
-        if not user.check_password(json["old_password"]):
+        if not user_.check_password(json["old_password"], password_hasher):
             return {"status": "Old passwords doesn't match"}, 406
 
-        user.generate_hash_password(json["new_password"])
+        user_.generate_hash_password(json["new_password"], password_hasher)
         sess.commit()
+        user_cache.pop(user_.id)
         return {"status": "success"}
     return {"status": "Forbidden"}, 403
 
@@ -386,17 +746,18 @@ def update_password(user_id):
 def delete_course(course_id):
     user = get_current_user()
 
-    sess = create_session()
+    sess = db_session()
     course = sess.get(Course, course_id)
 
     if not course:
         return {"status": "Not found"}, 404
 
-    if user != course.author or not user.check_perm("/Ca"):
+    if user.id != course.author_id or not user.check_perm("/Ca"):
         return {"status": "Forbidden"}, 403
 
     sess.delete(course)
     sess.commit()
+    catalog_cache.invalidate()
     return {"status": "success"}
 
 
@@ -405,17 +766,18 @@ def delete_course(course_id):
 def delete_lesson(lesson_id):
     user = get_current_user()
 
-    sess = create_session()
-    lesson = sess.get(Lesson, lesson_id)
+    sess = db_session()
+    lesson = sess.get(Lesson, lesson_id, options=[joinedload(Lesson.course)])
 
     if not lesson:
         return {"status": "Not found"}, 404
 
-    if user != lesson.course.author or not user.check_perm("/Ca"):
+    if user.id != lesson.course.author_id or not user.check_perm("/Ca"):
         return {"status": "Forbidden"}, 403
 
     sess.delete(lesson)
     sess.commit()
+    catalog_cache.invalidate()
     return {"status": "success"}
 
 
@@ -424,17 +786,18 @@ def delete_lesson(lesson_id):
 def delete_task(task_id):
     user = get_current_user()
 
-    sess = create_session()
-    task = sess.get(Task, task_id)
+    sess = db_session()
+    task = sess.get(Task, task_id, options=[joinedload(Task.lesson).joinedload(Lesson.course)])
 
     if not task:
         return {"status": "Not found"}, 404
 
-    if user != task.lesson.course.author or not user.check_perm("/Ca"):
+    if user.id != task.lesson.course.author_id or not user.check_perm("/Ca"):
         return {"status": "Forbidden"}, 403
 
     sess.delete(task)
     sess.commit()
+    catalog_cache.invalidate()
     return {"status": "success"}
 
 
@@ -444,17 +807,18 @@ def delete_task(task_id):
 def delete_link(link_id):
     user = get_current_user()
 
-    sess = create_session()
-    link = sess.get(Link, link_id)
+    sess = db_session()
+    link = sess.get(Link, link_id, options=[joinedload(Link.lesson).joinedload(Lesson.course)])
 
     if not link:
         return {"status": "Not found"}, 404
 
-    if user != link.lesson.course.author or not user.check_perm("/Ca"):
+    if user.id != link.lesson.course.author_id or not user.check_perm("/Ca"):
         return {"status": "Forbidden"}, 403
 
     sess.delete(link)
     sess.commit()
+    catalog_cache.invalidate()
     return {"status": "success"}
 
 
@@ -463,7 +827,7 @@ def delete_link(link_id):
 def delete_user(user_id):
     user = get_current_user()
 
-    sess = create_session()
+    sess = db_session()
     user_ = sess.get(User, user_id)
 
     if not user.check_perm("/Ua"):
@@ -472,8 +836,10 @@ def delete_user(user_id):
     if not user_:
         return {"status": "Not found"}, 404
 
+    user_id = user_.id
     sess.delete(user_)
     sess.commit()
+    user_cache.pop(user_id)
     return {"status": "success"}
 
 
@@ -485,7 +851,7 @@ def delete_languages(language_id):
     if not user.check_perm("/Ca"):
         return {"status": "Forbidden"}, 403
 
-    sess = create_session()
+    sess = db_session()
 
     language = sess.get(Language, language_id)
 
@@ -494,6 +860,7 @@ def delete_languages(language_id):
 
     sess.delete(language)
     sess.commit()
+    catalog_cache.invalidate()
     return {"status": "success"}
 
 
@@ -505,9 +872,10 @@ def get_languages():
     if not user.check_perm("/C"):
         return {"status": "Forbidden"}, 403
 
-    sess = create_session()
+    view = View("language", request.args)
+    sess = db_session()
 
-    return {"languages": [language.to_json() for language in sess.query(Language).all()]}
+    return {"languages": view.dump_all(sess.query(Language).all())}
 
 
 @app.route("/refresh")
@@ -521,7 +889,13 @@ def refresh():
     # info = decode_token(refresh_jwt)
 
     current_user = get_jwt_identity()
-    access_token = create_access_token(identity=current_user)
+    # Перечитываем пользователя, чтобы в новый токен попали текущие полномочия
+    user_cache.pop(UUID(str(current_user)))
+    user = user_cache.load(current_user)
+    if user is None:
+        return {"status": "Not found"}, 404
+    access_token = create_access_token(identity=current_user,
+                                       additional_claims=access_claims(user))
     return {'jwt_access': access_token}
 
 
@@ -541,12 +915,17 @@ def add_language():
     name = form["name"]
     path = form["path"]
     options = form["options"]
+    runner = form.get("runner", "process")
+    extension = form.get("extension", "py")
 
-    sess = create_session()
-    language = Language(name, path, options)
+    if runner not in RUNNERS:
+        return {"status": f"runner should be one of {', '.join(RUNNERS)}"}, 400
+
+    sess = db_session()
+    language = Language(name, path, options, runner, extension)
     sess.add(language)
     sess.commit()
-    return {"status": "success", "language": language.to_json()}
+    return {"status": "success", "language": View("language").dump(language)}
 
 
 @app.route("/courses", methods=["POST"])
@@ -572,24 +951,29 @@ def add_course():
     language_id = form["language_id"]
     is_public = bool(form["is_public"])
 
-    sess = create_session()
+    sess = db_session()
 
     language = sess.get(Language, language_id)
     if not language:
         return {"status": "Language not found"}, 404
 
+    try:
+        pic, variants = picture_store.save(files["pic"].read(), files["pic"].filename or "")
+    except PictureError as e:
+        return {"status": str(e)}, 400
+
     course = Course(name, description, UUID(language_id), is_public)
     course.author_id = user.id
+    course.pic = pic
+    course.pic_variants = variants
 
     sess.add(course)
+    sess.flush()
+    sess.add(Picture(course.id, pic, 0, variants))
     sess.commit()
+    catalog_cache.invalidate()
 
-    pic = f"static/{course.id}.{files['pic'].filename.split('.')[-1]}"
-    files["pic"].save(pic)
-    course.pic = pic
-    sess.commit()
-
-    return {"status": "success", "course": course.to_json()}
+    return {"status": "success", "course": View("course", fields="*,language,lessons").dump(course)}
 
 
 @app.route("/lessons", methods=["POST"])
@@ -610,13 +994,13 @@ def add_lesson():
     course_id = form["course_id"]
     links = form.get("links", [])
 
-    sess = create_session()
+    sess = db_session()
 
     course = sess.get(Course, course_id)
     if not course:
         return {"status": "Course not found"}, 404
 
-    if course.author.id != user.id:
+    if course.author_id != user.id:
         return {"status": "Forbidden"}, 403
 
     lessons = sess.query(Lesson).filter(Lesson.course_id == course.id).order_by(Lesson.order).all()
@@ -634,14 +1018,15 @@ def add_lesson():
         lesson.links.append(obj)
 
     sess.commit()
+    catalog_cache.invalidate()
 
-    return {"status": "success", "lesson": lesson.to_json()}
+    return {"status": "success", "lesson": View("lesson", fields="*,tasks,links").dump(lesson)}
 
 
 @app.route("/tasks", methods=["POST"])
 @jwt_required()
 def add_task():
-    sess = create_session()
+    sess = db_session()
     sess.expire_on_commit = False
     user = get_current_user()
 
@@ -674,17 +1059,19 @@ def add_task():
 
     sess.add(task)
     sess.commit()
+    catalog_cache.invalidate()
 
-    return {"status": "success", "task": task.to_json()}
+    return {"status": "success", "task": View("task", fields="*").dump(task)}
 
 
 @app.route("/auth")
 @jwt_required()
 def get_user_info():
-    user = get_current_user()
+    view = View("user", request.args, expand="role")
+    sess = db_session()
+    user = sess.get(User, get_current_user().id, options=view.options())
 
-    user_info = user.to_json()
-    user_info.pop("courses")
+    user_info = view.dump(user)
 
     return {"info": user_info}
 
@@ -707,7 +1094,7 @@ def update_courses():
     if "id" not in form:
         return {"status": "Error: you should send id of course that you want to edit"}, 400
 
-    sess = create_session()
+    sess = db_session()
 
     course = sess.get(Course, form.pop("id"))
 
@@ -725,12 +1112,16 @@ def update_courses():
     for key, value in form.items():
         course.__setattr__(key, value)
 
+    sess.commit()
+    catalog_cache.invalidate()
     return {"status": "ok"}
 
 
 if __name__ == "__main__":
-    global_init(db_password, db_username, db_address, db_name)
-    prepare_starting()
-    g_sess = create_session()
-    g_sess.expire_on_commit = False
-    app.run(threaded=True, debug=True, host="0.0.0.0", port=5000)
+    create_app()
+    start_background()
+    try:
+        # Для продакшена - gunicorn -c gunicorn.conf.py wsgi:app
+        app.run(threaded=True, debug=debug, use_reloader=False, host="0.0.0.0", port=5000)
+    finally:
+        shutdown(shutdown_timeout)
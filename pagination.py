@@ -0,0 +1,92 @@
+"""
+Постраничная выдача списков по ключу (keyset pagination).
+
+Страница - это запрос с условием (колонки) > (значения из курсора)
+и ORDER BY по тем же колонкам, поэтому база не пропускает
+предыдущие строки, как при OFFSET. Последняя колонка должна быть
+уникальной (обычно id), чтобы порядок был однозначным.
+Курсор - base64 от JSON со значениями колонок последней строки.
+"""
+import base64
+import datetime
+import json
+import uuid
+
+import sqlalchemy as sa
+
+
+class PageError(ValueError):
+    """Неправильный курсор или размер страницы"""
+
+
+def encode_cursor(values) -> str:
+    data = json.dumps([str(value) for value in values], ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, columns) -> list:
+    """Восстанавливает значения курсора с типами колонок"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError()
+        return [_convert(value, column) for value, column in zip(values, columns)]
+    except (ValueError, TypeError, NotImplementedError):
+        raise PageError("Invalid cursor")
+
+
+def _convert(value: str, column):
+    python_type = column.type.python_type
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    if python_type is datetime.date:
+        return datetime.date.fromisoformat(value)
+    if python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    return python_type(value)
+
+
+class Page:
+    def __init__(self, args, columns: tuple,
+                 descending: bool = False,
+                 default_limit: int = 50,
+                 max_limit: int = 200):
+        """
+        :param args: параметры запроса (request.args) с cursor и limit
+        :param columns: колонки порядка, последняя - уникальная
+        :param descending: сначала большие значения (например, новые решения)
+        :param default_limit: размер страницы, если limit не передан
+        :param max_limit: максимальный размер страницы
+        :raises PageError: если limit или cursor неправильные
+        """
+        self.columns = columns
+        self.descending = descending
+        try:
+            self.limit = int(args.get("limit", default_limit))
+        except ValueError:
+            raise PageError("limit should be a number")
+        if not 1 <= self.limit <= max_limit:
+            raise PageError(f"limit should be from 1 to {max_limit}")
+
+        cursor = args.get("cursor")
+        self.after = decode_cursor(cursor, columns) if cursor else None
+
+    def apply(self, query):
+        """Добавляет к запросу (Select или Query) условие курсора, порядок и лимит"""
+        if self.after is not None:
+            key, after = sa.tuple_(*self.columns), sa.tuple_(*self.after)
+            query = query.filter(key < after if self.descending else key > after)
+        order = [column.desc() if self.descending else column for column in self.columns]
+        # Лишняя строка показывает, есть ли следующая страница
+        return query.order_by(*order).limit(self.limit + 1)
+
+    def split(self, rows: list):
+        """
+        :param rows: результат запроса из apply
+        :return: (строки страницы, курсор следующей страницы или None)
+        """
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        last = rows[-1]
+        return rows, encode_cursor(getattr(last, column.key) for column in self.columns)
@@ -0,0 +1,63 @@
+"""
+Хэширование паролей в отдельных процессах.
+
+Хэш пароля специально считается долго, поэтому при массовом входе в начале урока
+хэширование в потоках запросов занимает все ядра и задерживает остальные запросы.
+PasswordHasher считает хэши в пуле из нескольких процессов, а поток запроса только ждёт результат.
+Пул создаётся при первом обращении, то есть уже в процессе сервера (после fork).
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher:
+    def __init__(self, method: str = "pbkdf2:sha256",
+                 salt_length: int = 16,
+                 workers: int = 2):
+        """
+        :param method: алгоритм и стоимость в формате werkzeug (например, pbkdf2:sha256:600000)
+        :param salt_length: длина соли
+        :param workers: количество процессов (0 - считать в потоке запроса)
+        """
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self._prefix = None  # начало хэша с текущими параметрами ("pbkdf2:sha256:260000")
+        self._executor = None
+        self._lock = Lock()
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        with self._lock:
+            if self._executor is None:
+                # spawn: процессы не наследуют потоки и блокировки процесса сервера
+                self._executor = ProcessPoolExecutor(self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            executor = self._executor
+        return executor.submit(function, *args).result()
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """
+        :return: True, если хэш посчитан с другим алгоритмом, стоимостью или длиной соли
+        """
+        if self._prefix is None:
+            # Параметры по умолчанию (например, число итераций) знает только werkzeug
+            self._prefix = self.hash("").split("$", 1)[0]
+        parts = pwhash.split("$")
+        return len(parts) != 3 or parts[0] != self._prefix or len(parts[1]) != self.salt_length
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
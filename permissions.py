@@ -0,0 +1,58 @@
+"""
+Полномочия ролей в виде битовой маски.
+
+Строка полномочий роли (например, "/Ca /u") разбирается один раз,
+старшие полномочия сразу включают младшие своего блока (/c < /C < /Ca, /u < /U < /Ua),
+поэтому проверка - одна операция с маской. Маска и версия роли
+кладутся в access-токен (claims perms, rv и role).
+"""
+import uuid
+import zlib
+
+# Полномочия в порядке возрастания внутри блока
+_BLOCKS = (("/c", "/C", "/Ca"), ("/u", "/U", "/Ua"))
+
+PERMISSIONS = {}  # полномочие -> бит
+IMPLIED = {}  # полномочие -> маска со всеми полномочиями, которые оно включает
+for _block in _BLOCKS:
+    _mask = 0
+    for _permission in _block:
+        PERMISSIONS[_permission] = 1 << len(PERMISSIONS)
+        _mask |= PERMISSIONS[_permission]
+        IMPLIED[_permission] = _mask
+
+
+def parse(permissions: str) -> int:
+    """
+    :param permissions: строка полномочий роли через пробел
+    :return: маска полномочий (неизвестные полномочия пропускаются)
+    """
+    mask = 0
+    for permission in (permissions or "").split():
+        mask |= IMPLIED.get(permission, 0)
+    return mask
+
+
+def has(mask: int, *permissions) -> bool:
+    """
+    :param mask: маска полномочий пользователя
+    :param permissions: нужные полномочия, например "/c", "/Ua"
+    :return: True, если есть все переданные полномочия
+    """
+    required = 0
+    for permission in permissions:
+        required |= PERMISSIONS[permission]
+    return mask & required == required
+
+
+def role_version(permissions: str) -> int:
+    """Меняется при любом изменении строки полномочий роли"""
+    return zlib.crc32((permissions or "").encode("utf8"))
+
+
+def make_claims(role_id: uuid.UUID, permissions: str) -> dict:
+    """Claims access-токена с полномочиями пользователя"""
+    return {"perms": parse(permissions),
+            "rv": role_version(permissions),
+            "role": str(role_id)}
+
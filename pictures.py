@@ -0,0 +1,100 @@
+"""
+Картинки курсов.
+
+Загруженная картинка декодируется один раз и уменьшается до нескольких размеров
+(от большего к меньшему, каждый следующий - из предыдущего), варианты сохраняются в WebP.
+Имя файла - хэш исходного файла и размер, поэтому содержимое по одному адресу
+никогда не меняется и его можно кэшировать навсегда (Cache-Control: immutable).
+Одинаковые загрузки дают те же файлы и повторно не обрабатываются.
+Без Pillow картинка сохраняется как есть, тоже под именем по хэшу.
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow уменьшенные копии не создаются
+    Image = None
+
+EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp")  # какие файлы можно загружать
+MAX_AGE = 365 * 24 * 60 * 60  # время кэширования картинок в браузере (в секундах)
+
+
+class PictureError(ValueError):
+    """Файл не является картинкой"""
+
+
+class PictureStore:
+    def __init__(self, directory: str,
+                 sizes: tuple = (160, 480, 1200),
+                 quality: int = 80,
+                 url_prefix: str = "pictures"):
+        """
+        :param directory: папка для файлов картинок
+        :param sizes: размеры уменьшенных копий (большая сторона в пикселях)
+        :param quality: качество WebP (0-100)
+        :param url_prefix: путь, по которому картинки отдаёт сервер
+        """
+        self.directory = os.path.abspath(directory)
+        self.sizes = tuple(sorted(sizes, reverse=True))
+        self.quality = quality
+        self.url_prefix = url_prefix
+
+    def url(self, name: str) -> str:
+        return f"{self.url_prefix}/{name}"
+
+    def save(self, data: bytes, filename: str) -> tuple:
+        """
+        Сохраняет картинку и её уменьшенные копии
+        :param data: содержимое файла
+        :param filename: имя загруженного файла (нужно только расширение)
+        :return: (адрес основной картинки, {размер: адрес уменьшенной копии})
+        :raises PictureError: если файл не картинка
+        """
+        extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+        if extension not in EXTENSIONS:
+            raise PictureError(f"Picture should be one of: {', '.join(EXTENSIONS)}")
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        os.makedirs(self.directory, exist_ok=True)
+
+        if Image is None:
+            name = f"{digest}.{extension}"
+            self._write(name, lambda f: f.write(data))
+            return self.url(name), {}
+
+        names = {size: f"{digest}-{size}.webp" for size in self.sizes}
+        if not all(os.path.exists(os.path.join(self.directory, name)) for name in names.values()):
+            self._resize(data, names)
+        variants = {str(size): self.url(name) for size, name in names.items()}
+        return variants[str(self.sizes[0])], variants
+
+    def _resize(self, data: bytes, names: dict):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                # JPEG можно сразу декодировать в уменьшенном виде
+                image.draft("RGB", (self.sizes[0], self.sizes[0]))
+                image = ImageOps.exif_transpose(image)
+                has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+                image = image.convert("RGBA" if has_alpha else "RGB")
+        except (OSError, ValueError, Image.DecompressionBombError):
+            raise PictureError("File is not a picture")
+
+        for size in self.sizes:
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            self._write(names[size], lambda f: image.save(f, "WEBP", quality=self.quality, method=4))
+
+    def _write(self, name: str, write):
+        """Записывает файл через временный, чтобы сервер не отдал его недописанным"""
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
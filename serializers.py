@@ -0,0 +1,247 @@
+"""
+Сериализация моделей в ответы API.
+
+У каждой модели есть форма (Shape): набор полей и связей. По умолчанию
+отдаются только краткие поля (summary), остальное клиент просит сам:
+    ?fields=name,lessons.name - какие поля отдать (* - все поля уровня)
+    ?expand=lessons.tasks - какие связи вложить (с их краткими полями)
+Связь, упомянутая в fields, вкладывается автоматически.
+По тем же параметрам строятся опции загрузки, поэтому из базы
+читается только то, что попадёт в ответ.
+"""
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import joinedload, selectinload
+
+from data.__all_models import Course, Lesson, Solve, User
+
+try:
+    import orjson
+except ImportError:  # без orjson ответы кодирует стандартный json
+    orjson = None
+
+
+class FieldError(ValueError):
+    """Клиент запросил поле или связь, которых нет"""
+
+
+def parse_paths(value: str) -> dict:
+    """
+    "a,b.c,b.d" -> {"a": {}, "b": {"c": {}, "d": {}}}
+    """
+    tree = {}
+    for path in (value or "").split(","):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def merge_paths(*trees: dict) -> dict:
+    result = {}
+    for tree in trees:
+        for name, children in tree.items():
+            result[name] = merge_paths(result.get(name, {}), children)
+    return result
+
+
+class Relation:
+    def __init__(self, attribute, shape: str, many: bool = True):
+        """
+        :param attribute: атрибут модели (например, Course.lessons)
+        :param shape: имя формы связанной модели в SHAPES
+        :param many: связь один-ко-многим (список) или многие-к-одному (объект)
+        """
+        self.attribute = attribute
+        self.shape = shape
+        self.many = many
+
+    def loader(self):
+        # Списки догружаем отдельным запросом, одиночные объекты - через JOIN
+        return selectinload(self.attribute) if self.many else joinedload(self.attribute)
+
+
+class Shape:
+    def __init__(self, fields: dict, summary: tuple, relations: dict = None):
+        """
+        :param fields: имя поля -> функция, достающая значение из объекта
+        :param summary: поля, которые отдаются, если клиент не указал fields
+        :param relations: имя связи -> Relation
+        """
+        self.fields = fields
+        self.summary = summary
+        self.relations = relations or {}
+
+    def _split(self, fields: dict, expand: dict):
+        """
+        :return: (список полей, {имя связи: (fields, expand) для связи})
+        """
+        for name in fields:
+            if name != "*" and name not in self.fields and name not in self.relations:
+                raise FieldError(f"Unknown field '{name}'")
+        for name in expand:
+            if name not in self.relations:
+                raise FieldError(f"Unknown relation '{name}'")
+
+        plain = [name for name in fields if name in self.fields]
+        if "*" in fields:
+            plain = list(self.fields)
+        elif not plain:
+            plain = list(self.summary)
+
+        relations = {}
+        for name in self.relations:
+            if name in expand or name in fields:
+                relations[name] = (fields.get(name, {}), expand.get(name, {}))
+        return plain, relations
+
+    def dump(self, obj, fields: dict = None, expand: dict = None) -> dict:
+        plain, relations = self._split(fields or {}, expand or {})
+        result = {name: self.fields[name](obj) for name in plain}
+        for name, (sub_fields, sub_expand) in relations.items():
+            relation = self.relations[name]
+            shape = SHAPES[relation.shape]
+            value = getattr(obj, relation.attribute.key)
+            if relation.many:
+                result[name] = [shape.dump(item, sub_fields, sub_expand) for item in value]
+            else:
+                result[name] = None if value is None else shape.dump(value, sub_fields, sub_expand)
+        return result
+
+    def loader_options(self, fields: dict = None, expand: dict = None) -> list:
+        """Опции загрузки для связей, которые попадут в ответ"""
+        _, relations = self._split(fields or {}, expand or {})
+        options = []
+        for name, (sub_fields, sub_expand) in relations.items():
+            relation = self.relations[name]
+            nested = SHAPES[relation.shape].loader_options(sub_fields, sub_expand)
+            options.append(relation.loader().options(*nested) if nested else relation.loader())
+        return options
+
+
+def _attr(name):
+    return lambda obj: getattr(obj, name)
+
+
+def _columns(*names) -> dict:
+    return {name: _attr(name) for name in names}
+
+
+SHAPES = {
+    "language": Shape(
+        _columns("id", "name", "runner"),
+        summary=("id", "name", "runner")
+    ),
+    "role": Shape(
+        _columns("id", "title", "permissions"),
+        summary=("id", "title", "permissions")
+    ),
+    "picture": Shape(
+        _columns("id", "path", "order", "variants"),
+        summary=("id", "path", "order", "variants")
+    ),
+    "link": Shape(
+        _columns("link", "title"),
+        summary=("link", "title")
+    ),
+    "task": Shape(
+        {**_columns("id", "name", "task_condition", "time_limit", "order", "lesson_id"),
+         # Клиенту показываем только первые два теста
+         "tests": lambda task: task.tests["tests"][:2]},
+        summary=("id", "name", "time_limit", "order")
+    ),
+    "lesson": Shape(
+        _columns("id", "name", "description", "order", "course_id"),
+        summary=("id", "name", "description", "order"),
+        relations={"tasks": Relation(Lesson.tasks, "task"),
+                   "links": Relation(Lesson.links, "link"),
+                   "course": Relation(Lesson.course, "course", many=False)}
+    ),
+    "course": Shape(
+        _columns("id", "name", "description", "pic", "pic_variants", "is_public", "author_id"),
+        summary=("id", "name", "description", "pic", "pic_variants", "is_public"),
+        relations={"language": Relation(Course.language, "language", many=False),
+                   "lessons": Relation(Course.lessons, "lesson"),
+                   "pictures": Relation(Course.pictures, "picture")}
+    ),
+    "test_result": Shape(
+        _columns("number", "status", "cpu_time", "wall_time", "memory"),
+        summary=("number", "status", "cpu_time", "wall_time", "memory")
+    ),
+    "solve": Shape(
+        _columns("id", "task_id", "user_id", "verdict", "code", "time", "memory", "date", "created_at"),
+        summary=("id", "task_id", "verdict", "time", "memory", "date"),
+        relations={"task": Relation(Solve.task, "task", many=False),
+                   "tests": Relation(Solve.tests, "test_result")}
+    ),
+    "user": Shape(
+        _columns("id", "name", "login", "email"),
+        summary=("id", "name", "login", "email"),
+        relations={"role": Relation(User.role, "role", many=False),
+                   "courses": Relation(User.courses, "course")}
+    ),
+}
+
+
+class View:
+    """Поля и связи, которые клиент запросил у одного обработчика"""
+
+    def __init__(self, shape: str, args=None, fields: str = "", expand: str = ""):
+        """
+        :param shape: имя формы в SHAPES
+        :param args: параметры запроса (request.args)
+        :param fields: поля по умолчанию, если клиент не передал fields
+        :param expand: связи, которые вкладываются всегда (клиент может добавить свои)
+        :raises FieldError: если запрошено неизвестное поле
+        """
+        args = args or {}
+        self.shape = SHAPES[shape]
+        self.fields = parse_paths(args.get("fields") or fields)
+        self.expand = merge_paths(parse_paths(expand), parse_paths(args.get("expand", "")))
+        # Ошибку в параметрах показываем сразу, а не посреди сериализации
+        self.shape.loader_options(self.fields, self.expand)
+
+    def options(self) -> list:
+        return self.shape.loader_options(self.fields, self.expand)
+
+    def dump(self, obj) -> dict:
+        return self.shape.dump(obj, self.fields, self.expand)
+
+    def dump_all(self, objects) -> list:
+        return [self.dump(obj) for obj in objects]
+
+    def wants(self, name: str) -> bool:
+        """True, если в ответ попадёт связь name"""
+        return name in self.expand or name in self.fields
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Кодирует ответы через orjson, если он установлен. UUID orjson пишет сам,
+    а даты отдаются в default, чтобы формат не отличался от стандартного провайдера
+    """
+
+    def _options(self, pretty: bool) -> int:
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or set(kwargs) - {"indent", "separators", "sort_keys"}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default,
+                            option=self._options(bool(kwargs.get("indent")))).decode("utf8")
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        data = orjson.dumps(obj, default=self.default,
+                            option=self._options(pretty) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
@@ -0,0 +1,89 @@
+import json
+import queue
+import uuid
+from threading import Lock
+
+
+class SolveEvents:
+    """
+    Рассылка событий проверки решений тем, кто их ждёт.
+    Проверяющий вызывает publish, а обработчик запроса читает события из своей очереди.
+    События есть только у решений, которые проверяет этот же процесс, поэтому
+    вердикт решения из другого процесса обработчик читает из базы
+    """
+
+    def __init__(self, max_streams: int = None):
+        """
+        :param max_streams: сколько потоков событий можно держать одновременно (None - без ограничения)
+        """
+        self.max_streams = max_streams
+        self.streams = 0
+        self._closed = False
+        self._subscribers = {}  # ID решения -> множество очередей
+        self._lock = Lock()
+
+    def open_stream(self) -> bool:
+        """
+        Занимает место для потока событий. Каждый поток занимает поток обработки запросов
+        сервера, поэтому их количество ограничено, чтобы остальным запросам хватало потоков
+        :return: False, если все места заняты
+        """
+        with self._lock:
+            if self._closed or self.max_streams is not None and self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self.streams -= 1
+
+    def close(self):
+        """
+        Закрывает все потоки событием close (при остановке сервера), чтобы они не задерживали
+        остановку. Клиенты подключаются заново, уже к другому процессу
+        """
+        with self._lock:
+            self._closed = True
+            subscribers = [events for queues in self._subscribers.values() for events in queues]
+        for events in subscribers:
+            events.put({"type": "close"})
+
+    def subscribe(self, solve_id: uuid.UUID) -> queue.Queue:
+        events = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(solve_id, set()).add(events)
+            if self._closed:
+                events.put({"type": "close"})
+        return events
+
+    def unsubscribe(self, solve_id: uuid.UUID, events: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(solve_id)
+            if subscribers is None:
+                return
+            subscribers.discard(events)
+            if not subscribers:
+                del self._subscribers[solve_id]
+
+    def publish(self, solve_id: uuid.UUID, event: dict):
+        """
+        :param solve_id: ID решения
+        :param event: {"type": "progress" | "verdict" | "close", ...}
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(solve_id, ()))
+        for events in subscribers:
+            events.put(event)
+
+
+def format_sse(event: dict, retry: int = None) -> str:
+    """
+    Превращает событие в сообщение Server-Sent Events
+    :param retry: через сколько миллисекунд клиенту переподключаться после закрытия потока
+    """
+    data = json.dumps(event, default=str, ensure_ascii=False)
+    message = f"event: {event['type']}\ndata: {data}\n\n"
+    if retry is not None:
+        message = f"retry: {retry}\n" + message
+    return message
@@ -1,11 +1,193 @@
+import math
 import time
 import uuid
+import shlex
 from subprocess import Popen, PIPE, TimeoutExpired, run
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
 from sqlalchemy.orm import Session
 import os
+import signal
 
-from data.__all_models import Solve
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from data.__all_models import TestResult
+import forkserver
+from artifact_cache import ArtifactCache
+from verdict_cache import VerdictCache
+from solve_events import SolveEvents
+from verdict_writer import VerdictWriter, VerdictResult, write_verdicts, announce
+from comparators import make_comparator, COMPARE_EXACT
+
+OUTPUT_LIMIT = 16 * 1024 * 1024  # Максимальный размер вывода по умолчанию (16 МБ)
+CHUNK_SIZE = 64 * 1024
+
+# Способы запуска решений (Language.runner)
+RUNNER_PROCESS = "process"  # новый процесс интерпретатора на каждый тест
+RUNNER_FORKSERVER = "forkserver"  # fork прогретой зиготы (только для Python)
+RUNNER_COMPILED = "compiled"  # компиляция один раз, затем запуск бинарника на каждый тест
+RUNNERS = (RUNNER_PROCESS, RUNNER_FORKSERVER, RUNNER_COMPILED)
+
+COMPILE_TIMEOUT = 30  # Лимит времени на компиляцию по умолчанию (в секундах)
+WALL_FACTOR = 2  # Во сколько раз астрономическое время может превышать лимит процессорного
+
+
+class CompilationError(Exception):
+    """Решение не скомпилировалось"""
+
+
+class OutputCollector:
+    """Собирает вывод программы в памяти, пока он не превысит лимит"""
+
+    def __init__(self, limit: int):
+        """
+        :param limit: максимальный размер вывода в байтах
+        """
+        self.limit = limit
+        self.size = 0
+        self.overflow = False
+        self._chunks = []
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        :return: False, если программу нужно остановить
+        """
+        self.size += len(chunk)
+        if self.size > self.limit:
+            self.overflow = True
+            return False
+        self._chunks.append(chunk)
+        return True
+
+    def getvalue(self) -> str:
+        return b"".join(self._chunks).decode("utf8", errors="replace")
+
+
+def _write_input(stream, data: bytes):
+    try:
+        stream.write(data)
+    except (BrokenPipeError, OSError):
+        # Программа завершилась, не дочитав ввод
+        pass
+    finally:
+        try:
+            stream.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+
+def _read_output(process, stream, sink):
+    while True:
+        chunk = stream.read1(CHUNK_SIZE)
+        if not chunk:
+            break
+        if not sink.feed(chunk):
+            process.kill()
+            break
+    stream.close()
+
+
+class Usage:
+    """Ресурсы, потраченные решением на одном тесте"""
+
+    def __init__(self):
+        self.cpu_time = None  # user + sys, в секундах (None, если узнать не удалось)
+        self.wall_time = 0.0  # в секундах
+        self.memory = None  # пиковый RSS, в КБ
+        self.returncode = None
+        self.timed_out = False  # превышен лимит астрономического времени
+
+
+class SolutionProcess(Popen):
+    """Popen, который при завершении забирает rusage процесса через wait4"""
+
+    def wait4(self, timeout: float):
+        """
+        Ждёт завершения процесса так же, как Popen.wait, но через os.wait4
+        :return: (код возврата, процессорное время в секундах, пиковый RSS в КБ)
+        :raises TimeoutExpired: если процесс не завершился за timeout секунд
+        """
+        if not hasattr(os, "wait4"):
+            return self.wait(timeout), None, None
+
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Процесс уже забрал Popen.poll (например, при досрочной остановке)
+                return self.wait(), None, None
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                return (self.returncode, rusage.ru_utime + rusage.ru_stime,
+                        rusage.ru_maxrss)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+
+
+def make_result(i: int, status: str, usage: Usage) -> TestResult:
+    """
+    :param i: номер теста
+    :param status: OK, WA, TL, OL или RE
+    :param usage: потраченные ресурсы
+    """
+    cpu_time = usage.cpu_time if usage.cpu_time is not None else usage.wall_time
+    return TestResult(i, status, round(cpu_time * 1000),
+                      round(usage.wall_time * 1000), usage.memory)
+
+
+def limit_cpu_time(pid: int, seconds: float):
+    """Ставит процессу лимит процессорного времени, после которого ядро его убьёт"""
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    soft = math.ceil(seconds) + 1
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + 1))
+    except (ProcessLookupError, PermissionError, ValueError):
+        pass
+
+
+def communicate(process, input_data: bytes, timeout, stdout, stderr) -> Usage:
+    """
+    Передаёт программе ввод и читает её вывод через пайпы
+    :param process: SolutionProcess или ZygoteProcess с stdin, stdout и stderr = PIPE
+    :param input_data: ввод программы
+    :param timeout: лимит астрономического времени в секундах
+    :param stdout: приёмник stdout (OutputCollector или StreamingComparator)
+    :param stderr: приёмник stderr
+    :return: потраченные ресурсы
+    """
+    usage = Usage()
+    start_time = time.monotonic()
+
+    threads = [
+        Thread(target=_write_input, args=(process.stdin, input_data), daemon=True),
+        Thread(target=_read_output, args=(process, process.stdout, stdout), daemon=True),
+        Thread(target=_read_output, args=(process, process.stderr, stderr), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        usage.returncode, usage.cpu_time, usage.memory = process.wait4(timeout)
+    except TimeoutExpired:
+        usage.timed_out = True
+        process.kill()
+        usage.returncode, usage.cpu_time, usage.memory = process.wait4(timeout)
+    usage.wall_time = time.monotonic() - start_time
+
+    for thread in threads:
+        # Потомки программы могут держать пайпы открытыми, поэтому ждём недолго
+        thread.join(1)
+    return usage
 
 
 class TaskChecker:
@@ -15,14 +197,36 @@ class TaskChecker:
                  cmd: str,
                  tests: dict,
                  options: str,
-                 solve_uuid: uuid.UUID = ""):
+                 solve_uuid: uuid.UUID = "",
+                 output_limit: int = OUTPUT_LIMIT,
+                 test_workers: int = 1,
+                 runner: str = RUNNER_PROCESS,
+                 extension: str = "py",
+                 artifact_cache: ArtifactCache = None,
+                 compile_timeout: int = COMPILE_TIMEOUT,
+                 verdict_cache: VerdictCache = None,
+                 cache_key: tuple = None,
+                 events: SolveEvents = None,
+                 wall_factor: float = WALL_FACTOR,
+                 writer: VerdictWriter = None):
         """
         :param code: код
-        :param timeout: время на выполнение
+        :param timeout: лимит процессорного времени на тест в секундах
         :param cmd: путь до компилятора
-        :param tests: {"tests": [{"input": ..., "output": ...}, ...]}
+        :param tests: {"tests": [{"input": ..., "output": ...}, ...], "compare": "exact"}
         :param options: опции скрипта запуска
         :param solve_uuid: ID решения для создания потока
+        :param output_limit: максимальный размер вывода программы в байтах
+        :param test_workers: сколько тестов запускать одновременно
+        :param runner: способ запуска решения (RUNNER_PROCESS, RUNNER_FORKSERVER или RUNNER_COMPILED)
+        :param extension: расширение файла с кодом
+        :param artifact_cache: кэш скомпилированных решений (для RUNNER_COMPILED)
+        :param compile_timeout: лимит времени на компиляцию
+        :param verdict_cache: кэш, в который сохраняется вердикт после проверки
+        :param cache_key: ключ решения в verdict_cache
+        :param events: куда отправлять прогресс и вердикт проверки
+        :param wall_factor: во сколько раз астрономическое время может превышать timeout
+        :param writer: поток записи вердиктов (None - записать сразу в переданную сессию)
         """
         test_path = "tests"
         if not os.path.exists(test_path):
@@ -31,7 +235,8 @@ class TaskChecker:
         # self.path_to_file = os.path.join(os.getcwd(),
         #                                  "tests",
         #                                  f"{solve_uuid}.py")
-        self.path_to_file = f"tests/{solve_uuid}.py"
+        self.path_to_file = f"tests/{solve_uuid}.{extension or 'py'}"
+        self.path_to_binary = f"tests/{solve_uuid}.bin"
         with open(self.path_to_file, "w") as f:
             f.write(code)
 
@@ -39,112 +244,274 @@ class TaskChecker:
         self.timeout = timeout
         self.path = cmd
         self.tests = tests["tests"]
+        self.compare = tests.get("compare", COMPARE_EXACT)
         self.id = solve_uuid
         self.verdict = "Check"
         self.time_interval = None
         self.options = options
+        self.output_limit = output_limit
+        self.test_workers = test_workers
+        self.runner = runner or RUNNER_PROCESS
+        self.extension = extension
+        self.artifact_cache = artifact_cache
+        self.compile_timeout = compile_timeout
+        self.verdict_cache = verdict_cache
+        self.cache_key = cache_key
+        self.events = events
+        self.wall_factor = wall_factor
+        self.writer = writer
+        self.results = []  # TestResult пройденных тестов и первого непройденного
 
     def __call__(self, session: Session, *args, **kwargs):
-        solve = session.get(Solve, self.id)
+        # Компиляция и проверка тестов
+        verdict = self.compile()
+        if verdict is None:
+            if self.test_workers > 1 and len(self.tests) > 1:
+                verdict = self.run_parallel()
+            else:
+                verdict = self.run_sequential()
 
-        # Открытие файлов для сохранения ошибок и вывода
-        path_to_out = os.path.join(
-            os.getcwd(),
-            "tests",
-            f"{str(self.id)}_out"
-        )
+        self.verdict = verdict or "OK"
+        self.results.sort(key=lambda result: result.number)
+        memory = None
+        if self.results:
+            self.time_interval = max(round(i.cpu_time / 10) for i in self.results)
+            memory = max(i.memory or 0 for i in self.results)
+        self.cleanup()
+
+        result = VerdictResult(self.id, self.verdict, self.time_interval, memory,
+                               self.results, self.cache_key)
+        if self.writer is not None:
+            # Запишет поток записи вместе с другими вердиктами
+            self.writer.submit(result)
+        else:
+            write_verdicts(session, [result])
+            announce([result], self.verdict_cache, self.events)
+        return self.verdict
+
+    def compile(self):
+        """
+        Компилирует решение один раз перед всеми тестами (только для RUNNER_COMPILED).
+        Одинаковый код с теми же опциями берётся из artifact_cache без компиляции
+        :return: вердикт, если решение не скомпилировалось, иначе None
+        """
+        if self.runner != RUNNER_COMPILED:
+            return None
 
-        path_to_err = os.path.join(
-            os.getcwd(),
-            "tests",
-            f"{str(self.id)}_err"
-        )
+        try:
+            if self.artifact_cache is None:
+                self.build(self.path_to_binary)
+                return None
 
-        # Проверка тестов
-        is_ok = True
+            with open(self.path_to_file, "rb") as f:
+                source = f.read()
+            key = ArtifactCache.make_key(self.path, self.options, self.extension, source)
+            artifact = self.artifact_cache.get_or_build(key, self.build)
+        except CompilationError as e:
+            error = TaskChecker.format_errors(str(e))
+            return "Compilation error:\n" + error.replace(str(self.id), "solution")
 
+        # Жёсткая ссылка не даст кэшу удалить файл, пока идут тесты
+        try:
+            os.link(artifact, self.path_to_binary)
+        except OSError:
+            self.path_to_binary = artifact
+        return None
+
+    def build(self, output: str):
+        """
+        Компилирует решение в файл output
+        :raises CompilationError: если компилятор завершился с ошибкой
+        """
+        options = shlex.split(self.options or "")
+        if any("{source}" in i or "{output}" in i for i in options):
+            args = [self.path] + [i.replace("{source}", self.path_to_file)
+                                  .replace("{output}", output) for i in options]
+        else:
+            args = [self.path, *options, self.path_to_file, "-o", output]
+
+        try:
+            result = run(args, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                         timeout=self.compile_timeout)
+        except TimeoutExpired:
+            raise CompilationError("Compilation time limit exceeded")
+
+        if result.returncode != 0:
+            raise CompilationError((result.stderr or result.stdout).decode("utf8", errors="replace"))
+
+    def run_sequential(self):
+        """
+        Запускает тесты по очереди до первого непройденного
+        :return: вердикт первого непройденного теста или None
+        """
         for i, test in enumerate(self.tests, 1):
-            test_start_time = time.time()
-
-            out = open(path_to_out, "w")
-            err = open(path_to_err, "w")
-
-            is_timeout_expired = False
-            # Открытие потока выполнения программы
-            with Popen([self.path, self.path_to_file],
-                       stdin=PIPE,
-                       stdout=out,
-                       stderr=err,
-                       encoding="utf8",
-                       text=True
-                       ) as process:
-                try:
-                    stdout, stderr = process.communicate(test["input"],
-                                                         self.timeout)
-                except TimeoutExpired as te:
-                    is_timeout_expired = True
-                self.time_interval = round(
-                    (time.time() - test_start_time) * 100
-                )
-            out.close()
-            err.close()
-
-            with open(path_to_err) as err:
-                error = err.read()
-
-            with open(path_to_out) as out:
-                output = out.read()
-
-            os.remove(path_to_out)
-            os.remove(path_to_err)
-
-            if is_timeout_expired:
-                self.verdict = f"Time limit exceeded on test {i}"
-                is_ok = False
-                break
-
-            if error:
-                self.verdict = TaskChecker.format_errors(error)
-                self.verdict = self.verdict.replace(str(self.id), "solution")
-                is_ok = False
-                break
-
-            if output.strip() != test["output"]:
-                self.verdict = f"""Error:
+            verdict, result = self.run_test(i, test)
+            self.results.append(result)
+            if verdict is not None:
+                return verdict
+            self.publish_progress(i, i)
+        return None
+
+    def run_parallel(self):
+        """
+        Запускает тесты одновременно в test_workers потоках.
+        Как только какой-то тест не пройден, тесты с большими номерами
+        отменяются, а уже запущенные из них - убиваются.
+        :return: вердикт непройденного теста с наименьшим номером или None
+        :raises Exception: ошибка запуска теста (как в run_sequential), чтобы решение
+            получило "Internal error", а не "OK" без результатов
+        """
+        lock = Lock()
+        running = {}  # номер теста -> процесс
+        failures = {}  # номер теста -> вердикт
+        passed = []
+
+        def is_cancelled(i):
+            return bool(failures) and i > min(failures)
+
+        def job(i, test):
+            def on_start(process):
+                with lock:
+                    running[i] = process
+                    if is_cancelled(i):
+                        process.kill()
+
+            with lock:
+                if is_cancelled(i):
+                    return
+
+            verdict, result = self.run_test(i, test, on_start)
+
+            with lock:
+                running.pop(i, None)
+                if is_cancelled(i):
+                    # Тест был убит из-за падения более раннего теста
+                    return
+                self.results.append(result)
+                if verdict is None:
+                    passed.append(i)
+                    self.publish_progress(i, len(passed))
+                    return
+                failures[i] = verdict
+                for j, process in running.items():
+                    if j > i:
+                        process.kill()
+
+        with ThreadPoolExecutor(max_workers=self.test_workers,
+                                thread_name_prefix=f"{self.id}-test") as executor:
+            futures = [executor.submit(job, i, test) for i, test in enumerate(self.tests, 1)]
+        for future in futures:
+            future.result()
+
+        if failures:
+            first = min(failures)
+            # Тесты после первого непройденного, успевшие завершиться, не показываем
+            self.results = [i for i in self.results if i.number <= first]
+            return failures[first]
+        return None
+
+    def publish(self, event: dict):
+        if self.events is not None:
+            self.events.publish(self.id, event)
+
+    def publish_progress(self, i: int, passed: int):
+        """
+        :param i: номер пройденного теста
+        :param passed: сколько тестов пройдено всего
+        """
+        self.publish({"type": "progress", "test": i,
+                      "passed": passed, "total": len(self.tests)})
+
+    def run_test(self, i: int, test: dict, on_start=None):
+        """
+        Запускает решение на одном тесте
+        :param i: номер теста (начиная с 1)
+        :param test: {"input": ..., "output": ...}
+        :param on_start: функция, которая вызывается с процессом сразу после его запуска
+        :return: (вердикт, если тест не пройден, иначе None; TestResult с потраченными ресурсами)
+        """
+        stdout = make_comparator(test["output"], self.compare, self.output_limit)
+        stderr = OutputCollector(self.output_limit)
+
+        # Открытие потока выполнения программы
+        with self.spawn() as process:
+            if on_start is not None:
+                on_start(process)
+            usage = communicate(process,
+                                test["input"].encode("utf8"),
+                                self.timeout * self.wall_factor,
+                                stdout, stderr)
+
+        if usage.timed_out or self.is_cpu_limit_exceeded(usage):
+            return f"Time limit exceeded on test {i}", make_result(i, "TL", usage)
+
+        if stdout.overflow or stderr.overflow:
+            return f"Output limit exceeded on test {i}", make_result(i, "OL", usage)
+
+        error = stderr.getvalue()
+        if error:
+            verdict = TaskChecker.format_errors(error)
+            return verdict.replace(str(self.id), "solution"), make_result(i, "RE", usage)
+
+        # Программа упала молча (os._exit, sys.exit(1), сигнал) - вывод уже не важен.
+        # Если вывод разошёлся с ответом по ходу работы, программу убили мы сами
+        if usage.returncode and stdout.mismatch is None:
+            return f"Runtime error ({TaskChecker.describe_exit(usage.returncode)}) on test {i}", \
+                make_result(i, "RE", usage)
+
+        mismatch = stdout.finish()
+        if mismatch is not None:
+            return f"""Error:
                 In test {i}.
-                {TaskChecker.get_different_string(
-                    test['output'], output.strip()
-                )}"""
-                is_ok = False
-                break
-        if is_ok:
-            self.verdict = "OK"
-        solve.verdict = self.verdict
-        solve.time = self.time_interval
-        session.commit()
-        os.remove(self.path_to_file)
-        return self.verdict
+                {mismatch}""", make_result(i, "WA", usage)
+        return None, make_result(i, "OK", usage)
 
-    @staticmethod
-    def get_different_string(expectation: str, output: str) -> str:
-        splited_exp = expectation.split("\n")
-        splited_out = output.split("\n")
+    def is_cpu_limit_exceeded(self, usage: Usage) -> bool:
+        if usage.cpu_time is not None and usage.cpu_time > self.timeout:
+            return True
+        # Процесс убит ядром по RLIMIT_CPU
+        return hasattr(signal, "SIGXCPU") and usage.returncode == -signal.SIGXCPU
 
-        if len(splited_exp) != len(splited_out):
-            return f"Expected {len(splited_exp)}," \
-                   f" got {len(splited_out)} instead."
+    def spawn(self):
+        """
+        Запускает решение с stdin, stdout и stderr, открытыми как пайпы
+        :return: SolutionProcess или forkserver.ZygoteProcess
+        """
+        if self.runner == RUNNER_FORKSERVER and forkserver.is_supported():
+            server = forkserver.get_fork_server(self.path)
+            return server.spawn(os.path.abspath(self.path_to_file), self.timeout)
+
+        if self.runner == RUNNER_COMPILED:
+            args = [os.path.abspath(self.path_to_binary)]
+        else:
+            args = [self.path, self.path_to_file]
+
+        process = SolutionProcess(args,
+                                  stdin=PIPE,
+                                  stdout=PIPE,
+                                  stderr=PIPE)
+        limit_cpu_time(process.pid, self.timeout)
+        return process
+
+    def cleanup(self):
+        """Удаляет файл с кодом решения и его скомпилированную версию"""
+        for path in (self.path_to_file, f"tests/{self.id}.bin"):
+            if os.path.exists(path):
+                os.remove(path)
 
-        for i, e in enumerate(splited_exp):
-            if e != splited_out[i]:
-                return f"Expected {e} in line {i}," \
-                       f" got {splited_out[i]} instead."
-        return "Output doesn't match with example"
+    @staticmethod
+    def describe_exit(returncode: int) -> str:
+        """
+        :param returncode: код возврата, отрицательный - номер сигнала, которым убит процесс
+        :return: "exit code N" или "signal SIGNAME"
+        """
+        if returncode > 0:
+            return f"exit code {returncode}"
+        try:
+            return f"signal {signal.Signals(-returncode).name}"
+        except ValueError:
+            return f"signal {-returncode}"
 
     @staticmethod
     def format_errors(error_text: str) -> str:
         return error_text.replace(os.getcwd(), "*")
-
-    def run(self, session: Session) -> Thread:
-        thread = Thread(target=self, args=(session,), name=str(self.id))
-        thread.start()
-        return thread
@@ -0,0 +1,112 @@
+import copy
+import uuid
+
+from sqlalchemy.orm import joinedload
+
+from caching import LRUCache
+from permissions import parse, has, role_version
+from data.database import create_session
+from data.__all_models import User, Attendance, Role
+
+
+class CachedUser:
+    """
+    То, что обработчикам нужно знать о текущем пользователе.
+    Не привязан к сессии, поэтому его можно хранить в кэше между запросами
+    """
+
+    def __init__(self, user: User, course_ids):
+        """
+        :param user: пользователь с загруженной ролью
+        :param course_ids: ID курсов, на которых он учится
+        """
+        self.id = user.id
+        self.name = user.name
+        self.login = user.login
+        self.email = user.email
+        self.role_id = user.role_id
+        self.permissions = user.role.permissions if user.role else ""
+        self.perms = parse(self.permissions)  # маска полномочий (смотри permissions.py)
+        self.role_version = role_version(self.permissions)
+        self.course_ids = frozenset(course_ids)
+
+    def with_claims(self, claims: dict):
+        """
+        :param claims: payload access-токена
+        :return: копия пользователя с полномочиями из токена (если они там есть)
+        """
+        if "perms" not in claims:
+            return self
+        user = copy.copy(self)
+        user.perms = claims["perms"]
+        return user
+
+    def check_perm(self, *permissions) -> bool:
+        """
+        Метод для проверки полномочий
+        :param permissions:
+        :type permissions: Tuple[str]
+        :return: True, если у пользователя есть переданные полномочия
+        """
+        return has(self.perms, *permissions)
+
+    def check_course(self, course) -> bool:
+        """
+        Метод проверяет нахождение пользователя на курсе
+        :param course: курс, нахождение на котором мы проверяем
+        """
+        return course.id in self.course_ids
+
+
+class UserCache(LRUCache):
+    """
+    Кэш CachedUser по ID пользователя. Запись нужно сбрасывать (pop),
+    когда меняются курсы, роль или пароль пользователя
+    """
+
+    def load(self, user_id):
+        """
+        :return: CachedUser из кэша или из базы, None - если пользователя нет
+        """
+        user_id = uuid.UUID(str(user_id))
+        cached = self.get(user_id)
+        if cached is not None:
+            return cached
+
+        # Своя короткая сессия: пользователь не должен держать соединение или чужую сессию
+        sess = create_session()
+        try:
+            user = sess.get(User, user_id, options=[joinedload(User.role)])
+            if user is None:
+                return None
+            course_ids = [course_id for course_id, in
+                          sess.query(Attendance.course_id).filter(Attendance.user_id == user_id)]
+            cached = CachedUser(user, course_ids)
+        finally:
+            sess.close()
+
+        self.put(user_id, cached)
+        return cached
+
+
+class RoleCache(LRUCache):
+    """Кэш (маска, версия) по ID роли - для проверки, не устарел ли токен"""
+
+    def load(self, role_id):
+        """:return: (маска, версия) или None, если роли нет"""
+        role_id = uuid.UUID(str(role_id))
+        cached = self.get(role_id)
+        if cached is not None:
+            return cached
+
+        sess = create_session()
+        try:
+            role = sess.get(Role, role_id)
+            if role is None:
+                return None
+            cached = parse(role.permissions), role_version(role.permissions)
+        finally:
+            sess.close()
+
+        self.put(role_id, cached)
+        return cached
@@ -0,0 +1,59 @@
+import hashlib
+import json
+
+from caching import LRUCache
+
+# Вердикты, которые зависят от нагрузки на сервер, а не только от кода
+NON_DETERMINISTIC_VERDICTS = ("Time limit exceeded", "Internal error")
+# То же для ошибок внутри вердикта ("Compilation error:\n" + текст ошибки)
+NON_DETERMINISTIC_ERRORS = ("Compilation time limit exceeded",)
+
+
+def normalize_code(code: str) -> str:
+    """
+    Приводит переводы строк к \\n. Пробелы не убираются: внутри многострочной строки
+    они меняют вывод программы, и разные решения получили бы один вердикт
+    """
+    return code.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def tests_hash(tests: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(tests, sort_keys=True, ensure_ascii=False).encode("utf8")
+    ).hexdigest()
+
+
+def make_key(code: str, task, language) -> tuple:
+    """
+    Ключ кэша вердиктов. Изменение тестов или лимита времени задачи
+    меняет ключ, поэтому старые вердикты перестают находиться сами собой
+    :param code: код решения
+    :param task: объект Task
+    :param language: объект Language
+    """
+    code_hash = hashlib.sha256(normalize_code(code).encode("utf8")).hexdigest()
+    return (code_hash, task.id, tests_hash(task.tests), task.time_limit,
+            language.id, language.path, language.options, language.runner)
+
+
+def is_deterministic(verdict: str) -> bool:
+    return not (any(verdict.startswith(i) for i in NON_DETERMINISTIC_VERDICTS)
+                or any(i in verdict for i in NON_DETERMINISTIC_ERRORS))
+
+
+class VerdictCache(LRUCache):
+    """
+    Кэш (вердикт, время, память, результаты тестов) по ключу make_key.
+    Результаты тестов хранятся кортежами (номер, статус, cpu_time, wall_time, memory),
+    а не объектами TestResult, которые нельзя добавить сразу в несколько сессий
+    """
+
+    def store(self, key: tuple, verdict: str, time: int, memory: int = None, tests: list = ()):
+        """
+        :param memory: пиковое потребление памяти (в КБ)
+        :param tests: объекты TestResult
+        """
+        if is_deterministic(verdict):
+            rows = tuple((test.number, test.status, test.cpu_time, test.wall_time, test.memory)
+                         for test in tests)
+            self.put(key, (verdict, time, memory, rows))
@@ -0,0 +1,230 @@
+"""
+Запись вердиктов в базу одним потоком.
+
+Проверяющие потоки не пишут в solves сами, а отдают VerdictResult писателю.
+Писатель собирает результаты, пришедшие за несколько миллисекунд (или пока их
+не наберётся batch_size), и записывает их одной транзакцией: один UPDATE
+с executemany для solves и один INSERT для test_results. Только после
+коммита вердикты попадают в кэш и рассылаются ожидающим клиентам.
+"""
+import logging
+import queue
+import uuid
+from threading import Thread, Lock
+from time import monotonic
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from data.database import create_session
+from data.__all_models import Solve, TestResult
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class VerdictResult:
+    def __init__(self, solve_id: uuid.UUID,
+                 verdict: str,
+                 time: int,
+                 memory: int = None,
+                 tests: list = (),
+                 cache_key: tuple = None):
+        """
+        :param solve_id: ID решения
+        :param verdict: вердикт
+        :param time: максимальное процессорное время (в сотых долях секунды)
+        :param memory: пиковое потребление памяти (в КБ)
+        :param tests: объекты TestResult (ещё не добавленные в сессию)
+        :param cache_key: ключ кэша вердиктов или None
+        """
+        self.solve_id = solve_id
+        self.verdict = verdict
+        self.time = time
+        self.memory = memory
+        self.tests = tests
+        self.cache_key = cache_key
+
+    def solve_row(self) -> dict:
+        return {"id": self.solve_id, "verdict": self.verdict,
+                "time": self.time, "memory": self.memory}
+
+    def test_rows(self) -> list:
+        return [{"solve_id": self.solve_id, "number": test.number, "status": test.status,
+                 "cpu_time": test.cpu_time, "wall_time": test.wall_time, "memory": test.memory}
+                for test in self.tests]
+
+
+def write_verdicts(sess: Session, results: list):
+    """Записывает вердикты и результаты тестов одной транзакцией"""
+    sess.execute(sa.update(Solve), [result.solve_row() for result in results])
+    test_rows = [row for result in results for row in result.test_rows()]
+    if test_rows:
+        sess.execute(sa.insert(TestResult), test_rows)
+    sess.commit()
+
+
+def fail_solves(solve_ids: list, events=None):
+    """
+    Ставит вердикт "Internal error" решениям, которые ещё в статусе "Check",
+    чтобы они не остались в нём навсегда, и сообщает о нём подписчикам
+    """
+    if not solve_ids:
+        return
+    sess = create_session()
+    try:
+        failed = sess.scalars(sa.select(Solve.id).where(Solve.id.in_(solve_ids),
+                                                        Solve.verdict == "Check")).all()
+        if failed:
+            sess.execute(sa.update(Solve).where(Solve.id.in_(failed), Solve.verdict == "Check")
+                         .values(verdict="Internal error"))
+            sess.commit()
+    except Exception:
+        logger.exception("Can't save verdicts of %d solves", len(solve_ids))
+        sess.rollback()
+        failed = solve_ids  # клиенты всё равно не должны ждать до таймаута
+    finally:
+        sess.close()
+    if events is not None:
+        for solve_id in failed:
+            events.publish(solve_id, {"type": "verdict",
+                                      "verdict": "Internal error",
+                                      "time": None})
+
+
+def announce(results: list, verdict_cache=None, events=None):
+    """Кладёт записанные вердикты в кэш и сообщает о них подписчикам"""
+    for result in results:
+        if verdict_cache is not None and result.cache_key is not None:
+            verdict_cache.store(result.cache_key, result.verdict, result.time,
+                                result.memory, result.tests)
+        if events is not None:
+            events.publish(result.solve_id, {"type": "verdict",
+                                             "verdict": result.verdict,
+                                             "time": result.time})
+
+
+class VerdictWriter:
+    def __init__(self, batch_size: int = 100,
+                 interval: float = 0.005,
+                 verdict_cache=None,
+                 events=None):
+        """
+        :param batch_size: максимальное количество вердиктов в одной транзакции
+        :param interval: сколько секунд ждать следующие вердикты перед записью
+        :param verdict_cache: VerdictCache для записанных вердиктов
+        :param events: SolveEvents, куда сообщать о записанных вердиктах
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self.verdict_cache = verdict_cache
+        self.events = events
+
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._thread = None
+
+    def start(self):
+        """Запускает поток записи (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._work, name="verdict-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Записывает всё, что уже в очереди, и останавливает поток.
+        Вердикты, пришедшие после остановки, записываются здесь же. Если поток не успел
+        за timeout секунд, его очередь не записывается, а решения получают "Internal error"
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+        left = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                left.append(item)
+        if not left:
+            return
+        if thread.is_alive():
+            logger.warning("%d verdicts were not saved before shutdown", len(left))
+            fail_solves([result.solve_id for result in left], self.events)
+        else:
+            for i in range(0, len(left), self.batch_size):
+                self._write(left[i:i + self.batch_size])
+
+    def submit(self, result: VerdictResult):
+        self._queue.put(result)
+
+    def to_json(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed
+        }
+
+    def _work(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+    def _write(self, batch: list):
+        sess = create_session()
+        try:
+            write_verdicts(sess, batch)
+            written = batch
+        except Exception:
+            logger.exception("Can't save batch of %d verdicts, saving one by one", len(batch))
+            sess.rollback()
+            written = []
+            for result in batch:
+                try:
+                    write_verdicts(sess, [result])
+                    written.append(result)
+                except Exception:
+                    logger.exception("Can't save verdict of solve %s", result.solve_id)
+                    sess.rollback()
+        finally:
+            sess.close()
+
+        self.batches += 1
+        self.written += len(written)
+        self.failed += len(batch) - len(written)
+        announce(written, self.verdict_cache, self.events)
+
+        if len(written) != len(batch):
+            # Не сохранённым решениям ставим "Internal error" и в базе, иначе они навсегда
+            # останутся в "Check", а клиенты, читающие базу, будут ждать до таймаута
+            failed = {result.solve_id for result in written} ^ {result.solve_id for result in batch}
+            fail_solves(list(failed), self.events)
@@ -0,0 +1,154 @@
+"""
+Зигота для запуска решений на Python без повторного старта интерпретатора.
+
+Запускается интерпретатором языка: python zygote.py <fd сокета>.
+По сокету (SOCK_SEQPACKET) приходят запросы {"id": ..., "path": ..., "cpu_limit": ...}
+вместе с тремя дескрипторами (stdin, stdout, stderr). Для каждого запроса
+зигота делает fork, а дочерний процесс выполняет решение через runpy.
+В ответ отправляются {"id": ..., "pid": ...} сразу после fork
+и {"id": ..., "status": ..., "cpu_time": ..., "memory": ...} после завершения решения
+(процессорное время в секундах, пиковый RSS в КБ).
+
+Файл не импортирует ничего из проекта: интерпретатор языка может
+отличаться от интерпретатора сервера.
+"""
+import importlib
+import json
+import math
+import os
+import resource
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+# Модули, которые чаще всего нужны решениям: их импорт достаётся детям бесплатно
+PRELOAD_MODULES = ("math", "collections", "itertools", "functools", "heapq",
+                   "bisect", "re", "string", "random", "decimal", "fractions",
+                   "statistics", "datetime", "json", "typing", "dataclasses",
+                   "operator", "copy")
+
+
+def preload():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def run_child(path: str, fds: list, cpu_limit=None):
+    """Выполняется в дочернем процессе и никогда не возвращается"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+
+    if cpu_limit:
+        soft = math.ceil(cpu_limit) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    sys.stdin = open(0, "r", encoding="utf8", closefd=False)
+    sys.stdout = open(1, "w", encoding="utf8", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf8", closefd=False)
+    sys.argv = [path]
+
+    code = 0
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        # Убираем из трейсбека кадры runpy, чтобы он выглядел как при обычном запуске
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+    os._exit(code)
+
+
+def send(sock: socket.socket, message: dict):
+    sock.send(json.dumps(message).encode("utf8"))
+
+
+def serve(sock: socket.socket):
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w, warn_on_full_buffer=False)
+    # Обработчик нужен, чтобы SIGCHLD будил selector через wakeup_fd
+    signal.signal(signal.SIGCHLD, lambda *args: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
+    children = {}  # pid -> id запроса
+
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sock:
+                message, fds, _, _ = socket.recv_fds(sock, 4096, 3)
+                if not message:
+                    # Сервер закрыл сокет - завершаемся
+                    return
+                request = json.loads(message)
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    sock.close()
+                    os.close(wakeup_r)
+                    os.close(wakeup_w)
+                    run_child(request["path"], fds, request.get("cpu_limit"))
+
+                for fd in fds:
+                    os.close(fd)
+                children[pid] = request["id"]
+                send(sock, {"id": request["id"], "pid": pid})
+            else:
+                try:
+                    while os.read(wakeup_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                reap(sock, children)
+
+
+def reap(sock: socket.socket, children: dict):
+    while children:
+        try:
+            pid, status, usage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        request_id = children.pop(pid, None)
+        if request_id is not None:
+            send(sock, {"id": request_id,
+                        "status": os.waitstatus_to_exitcode(status),
+                        "cpu_time": usage.ru_utime + usage.ru_stime,
+                        "memory": usage.ru_maxrss})
+
+
+if __name__ == "__main__":
+    preload()
+    serve(socket.socket(fileno=int(sys.argv[1])))